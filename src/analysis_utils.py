@@ -1,32 +1,98 @@
 import geopandas as gpd
 import itertools
+import multiprocessing
+import os
+import time
 import matplotlib.pyplot as plt
 import networkx as nx
 import numpy as np
 import pandas as pd
 import seaborn as sns
+import torch
 
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from matplotlib.colors import Normalize
 from matplotlib.cm import ScalarMappable
 from transformers import pipeline
 from wordcloud import WordCloud
 
-
-def plot_activity_years(df):
-    df.reset_index(drop=True, inplace=True)
-
-    min_year = df['Start'].min()
-    max_year = df['End'].max()
-    num_years = max_year - min_year + 1
-
-    # Create a matrix to store the activity years of bands
-    activity_matrix = np.zeros((len(df), num_years))
-
-    # Fill the activity matrix
-    for i, row in df.iterrows():
-        start_idx = row['Start'] - min_year
-        end_idx = row['End'] - min_year
-        activity_matrix[i, start_idx:end_idx+1] = 1
+from src.utils.cache import SentimentStore
+
+# Above this number of bands, plot_activity_years plots the number of active bands per year
+# instead of one row per band
+ACTIVITY_MATRIX_MAX_BANDS = 2000
+
+SENTIMENT_MODEL = "facebook/bart-large-mnli"
+# Number of (text, label) pairs per forward pass
+SENTIMENT_BATCH_SIZE = 32
+
+SENTIMENT_STORE_PATH = "data/cache/sentiment.sqlite"
+
+# Distilled NLI checkpoint, several times faster than BART-large on CPU
+FAST_SENTIMENT_MODEL = "valhalla/distilbart-mnli-12-3"
+# Opt-in fast mode: get_sentiment(texts, labels, **FAST_SENTIMENT_OPTIONS)
+FAST_SENTIMENT_OPTIONS = {'model': FAST_SENTIMENT_MODEL, 'quantize': True, 'workers': 4}
+
+# Fixed sample of titles for `benchmark_sentiment`
+BENCHMARK_TITLES = [
+    "Master of Puppets", "Paranoid", "The Number of the Beast", "Painkiller", "Reign in Blood",
+    "Holy Diver", "Symbolic", "Blackwater Park", "Ace of Spades", "Crystal Mountain",
+    "Hallowed Be Thy Name", "Cemetery Gates", "Fade to Black", "Love You to Death",
+    "Freezing Moon", "Heaven and Hell", "Walk", "Dying Breed", "Hope Leaves", "Angel of Death",
+    "The Trooper", "Born Too Late", "Nothing Else Matters", "Raining Blood",
+]
+
+# Zero-shot classifiers loaded so far, by model, shared by every call in the process
+_classifiers = {}
+_sentiment_store = None
+# Worker processes of get_sentiment, kept across calls so that every worker loads its model once
+_worker_pools = {}
+
+
+def count_active_per_year(df):
+    """
+    Counts the bands active in every year, from their `Start` and `End` years (both included).
+
+    Every band adds 1 to a difference array at its start year and subtracts it after its end
+    year, so the counts are the cumulative sum of the array.
+
+    Returns:
+        pd.Series: The number of active bands, indexed by year.
+    """
+    starts = df['Start'].to_numpy(dtype=np.int64)
+    # Bands ending before they start are never active.
+    ends = np.maximum(df['End'].to_numpy(dtype=np.int64), starts - 1)
+    if len(starts) == 0:
+        return pd.Series(dtype=np.int64, name='Active Bands', index=pd.Index([], name='Year'))
+    min_year = starts.min()
+    num_years = max(ends.max(), starts.max()) - min_year + 1
+    changes = (np.bincount(starts - min_year, minlength=num_years + 1)
+               - np.bincount(ends - min_year + 1, minlength=num_years + 1))
+    return pd.Series(np.cumsum(changes[:-1]), name='Active Bands',
+                     index=pd.RangeIndex(min_year, min_year + num_years, name='Year'))
+
+
+def plot_activity_years(df, max_bands=ACTIVITY_MATRIX_MAX_BANDS):
+    if len(df) > max_bands:
+        active = count_active_per_year(df)
+        plt.fill_between(active.index, active.to_numpy(), color='tab:orange', alpha=0.6)
+        plt.xlabel('Year')
+        plt.ylabel('Number of Active Bands')
+        plt.title('Activity Years of Bands')
+        plt.grid(axis='x')
+
+        plt.show()
+        return
+
+    starts = df['Start'].to_numpy(dtype=np.int64)
+    ends = df['End'].to_numpy(dtype=np.int64)
+    min_year = starts.min()
+    max_year = ends.max()
+
+    # One row per band, True in the years the band was active
+    years = np.arange(min_year, max_year + 1)
+    activity_matrix = (years >= starts[:, None]) & (years <= ends[:, None])
 
     plt.xlabel('Year')
     plt.ylabel('Number of Bands')
@@ -82,13 +148,18 @@ def create_centrality_graph(G, centrality_measure, label):
     plt.show()
 
 
-def create_crosstable_heatmap(df, x, y, n_x=20, n_y=10):
+def create_crosstable_heatmap(df, x, y, n_x=20, n_y=10, values=None):
+    # Pre-aggregated input has one row per (x, y) pair, with the count in the `values` column
+    counts = df.groupby(y)[values].sum() if values else df[y].value_counts()
     # top_x = df[x].value_counts().nlargest(n_x).index.tolist()
-    top_y = df[y].value_counts().nlargest(n_y).index.tolist()
+    top_y = counts.nlargest(n_y).index.tolist()
     df = df[df[y].isin(top_y)]
     df.loc[:, y] = df[y].str.title() if df[y].dtype == 'object' else df[y]
 
-    cross_table = pd.crosstab(df[x], df[y])
+    if values:
+        cross_table = df.pivot_table(index=x, columns=y, values=values, aggfunc='sum', fill_value=0)
+    else:
+        cross_table = pd.crosstab(df[x], df[y])
     cross_table['Total'] = cross_table.sum(axis=1)
     cross_table.sort_values(by='Total', ascending=False, inplace=True)
 
@@ -117,12 +188,181 @@ def get_word_cloud(words):
     plt.show()
     
 
-def get_sentiment(text, labels):
-    pipe = pipeline(model="facebook/bart-large-mnli")
-    result = pipe(text,
-        candidate_labels=labels,
-    )
-    return result
+def get_classifier(model=SENTIMENT_MODEL, num_threads=None, quantize=False):
+    """
+    Returns the zero-shot classification pipeline of a model, loading it on first use only.
+
+    Args:
+        model (str): The NLI checkpoint of the classifier.
+        num_threads (int): The number of threads torch uses for inference. Defaults to the
+            torch default, one per core.
+        quantize (bool): Whether to quantize the linear layers of the model to int8 weights,
+            which speeds up CPU inference at a small cost in accuracy.
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if (model, quantize) not in _classifiers:
+        classifier = pipeline("zero-shot-classification", model=model)
+        if quantize:
+            classifier.model = torch.quantization.quantize_dynamic(classifier.model, {torch.nn.Linear},
+                                                                   dtype=torch.qint8)
+        _classifiers[model, quantize] = classifier
+    return _classifiers[model, quantize]
+
+
+def _classify_shard(texts, labels, batch_size, model, num_threads, quantize):
+    """Classifies a shard of texts in a worker process, see `get_sentiment`."""
+    classifier = get_classifier(model, num_threads, quantize)
+    return classifier(texts, candidate_labels=labels, batch_size=batch_size)
+
+
+def worker_threads(workers, num_threads=None):
+    """
+    Returns the number of threads pinned to each of `workers` worker processes, so that the
+    workers do not compete for the cores: `num_threads` if given, else an even share of them.
+    """
+    return num_threads or max(1, (os.cpu_count() or 1) // workers)
+
+
+def get_worker_pool(model, quantize, workers, num_threads):
+    """
+    Returns a pool of worker processes classifying texts with a model, starting it on first use.
+
+    The workers are spawned rather than forked, since torch does not support forking a process
+    that already ran inference, and each of them loads the model once, with `num_threads`
+    threads, before the pool is returned.
+    """
+    key = (model, quantize, workers, num_threads)
+    if key not in _worker_pools:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=get_classifier, initargs=(model, num_threads, quantize))
+        # Workers start on demand, and every one of them stays busy loading the model, so
+        # submitting one task per worker starts them all.
+        for future in [pool.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+        _worker_pools[key] = pool
+    return _worker_pools[key]
+
+
+def get_sentiment_store():
+    """Returns the process-wide store of classification results, opening it on first use."""
+    global _sentiment_store
+    if _sentiment_store is None:
+        _sentiment_store = SentimentStore(SENTIMENT_STORE_PATH)
+    return _sentiment_store
+
+
+def get_sentiment(texts, labels, batch_size=SENTIMENT_BATCH_SIZE, num_threads=None, model=SENTIMENT_MODEL,
+                  use_store=True, quantize=False, workers=1):
+    """
+    Classifies texts against candidate labels with a zero-shot classifier.
+
+    Every distinct text is classified once. Results are looked up in the result store first
+    (see `SentimentStore`), so only texts never classified against these labels with this model
+    go through the classifier, and their results are stored for the next run. The texts are
+    sorted by length before batching, so that the texts of a batch need little padding.
+
+    For a faster, slightly less accurate classification, pass `**FAST_SENTIMENT_OPTIONS`.
+
+    Args:
+        texts (str | list): A text, or a list of texts.
+        labels (list): The candidate labels.
+        batch_size (int): The number of (text, label) pairs per forward pass.
+        num_threads (int): The number of threads torch uses for inference, in each worker
+            process. Defaults to the cores shared evenly between the workers.
+        model (str): The NLI checkpoint of the classifier.
+        use_store (bool): Whether to read and write the result store.
+        quantize (bool): Whether to run the model with int8 dynamically quantized weights.
+        workers (int): The number of worker processes classifying the texts, see
+            `get_worker_pool`. With a single worker, or a single text to classify, the texts
+            are classified in the calling process.
+
+    Returns:
+        dict | list: The result of the classifier (`sequence`, `labels` and `scores`) for a
+            single text, or the list of results of the texts, in input order.
+    """
+    single = isinstance(texts, str)
+    if single:
+        texts = [texts]
+    # Quantized results are stored apart from the full-precision ones.
+    model_id = f"{model}:int8" if quantize else model
+    normalized = [SentimentStore.normalize(text) for text in texts]
+    unique = list(dict.fromkeys(normalized))
+    scores = get_sentiment_store().get_many(unique, labels, model_id) if use_store else {}
+
+    missing = sorted((text for text in unique if text not in scores), key=len)
+    if missing:
+        # One shard per worker, taking every `workers`-th text so that the shards are the same
+        # size and mix short and long texts alike.
+        shards = [missing[i::workers] for i in range(min(workers, len(missing)))]
+        if len(shards) > 1:
+            num_threads = worker_threads(workers, num_threads)
+            classify = partial(_classify_shard, labels=labels, batch_size=batch_size, model=model,
+                               num_threads=num_threads, quantize=quantize)
+            classified = get_worker_pool(model, quantize, workers, num_threads).map(classify, shards)
+        else:
+            classified = [_classify_shard(missing, labels, batch_size, model, num_threads, quantize)]
+        new_scores = {text: dict(zip(result['labels'], result['scores']))
+                      for shard, results in zip(shards, classified) for text, result in zip(shard, results)}
+        if use_store:
+            get_sentiment_store().put_many(new_scores, labels, model_id)
+        scores.update(new_scores)
+
+    results = []
+    for text, key in zip(texts, normalized):
+        ranked = sorted(scores[key].items(), key=lambda item: item[1], reverse=True)
+        results.append({'sequence': text, 'labels': [label for label, _ in ranked],
+                        'scores': [score for _, score in ranked]})
+    return results[0] if single else results
+
+
+def benchmark_sentiment(labels, texts=None, **options):
+    """
+    Compares a configuration of `get_sentiment` with the full-precision model on a fixed sample
+    of titles, bypassing the result store, and prints the throughput of both and how often
+    they agree.
+
+    Usage:
+        benchmark_sentiment(["anxiety", "depression", "happiness", "love", "anger", "hope"],
+                            **FAST_SENTIMENT_OPTIONS)
+
+    Args:
+        labels (list): The candidate labels.
+        texts (list): The sample of texts. Defaults to `BENCHMARK_TITLES`.
+        **options: The options of `get_sentiment` to benchmark. Defaults to the fast mode.
+
+    Returns:
+        dict: The throughput of both configurations in texts per second, the share of texts
+            for which they pick the same top label, and the mean absolute difference between
+            their scores.
+    """
+    texts = list(dict.fromkeys(texts or BENCHMARK_TITLES))
+    options = options or FAST_SENTIMENT_OPTIONS
+
+    def run(model=SENTIMENT_MODEL, quantize=False, workers=1, num_threads=None, **run_options):
+        run_options.update(model=model, quantize=quantize, workers=workers, num_threads=num_threads)
+        # Load the model first, in the worker processes if there are several, so that starting
+        # them and loading the model is not counted as inference time.
+        if workers > 1 and len(texts) > 1:
+            get_worker_pool(model, quantize, workers, worker_threads(workers, num_threads))
+        else:
+            get_classifier(model, num_threads, quantize)
+        start = time.perf_counter()
+        results = get_sentiment(texts, labels, use_store=False, **run_options)
+        return results, len(texts) / (time.perf_counter() - start)
+
+    reference, reference_rate = run()
+    candidate, candidate_rate = run(**options)
+    agreement = float(np.mean([ref['labels'][0] == cand['labels'][0] for ref, cand in zip(reference, candidate)]))
+    score_diff = float(np.mean([abs(dict(zip(ref['labels'], ref['scores']))[label]
+                              - dict(zip(cand['labels'], cand['scores']))[label])
+                          for ref, cand in zip(reference, candidate) for label in labels]))
+
+    print(f"Full precision: {reference_rate:.1f} texts/s")
+    print(f"{options}: {candidate_rate:.1f} texts/s ({candidate_rate / reference_rate:.1f}x)")
+    print(f"Top label agreement: {agreement:.1%}, mean score difference: {score_diff:.3f} over {len(texts)} texts")
+    return {'reference_rate': reference_rate, 'rate': candidate_rate, 'agreement': agreement,
+            'score_difference': score_diff}
 
 
 def plot_choropleth_map(df, entity):
@@ -1,7 +1,63 @@
+import argparse
 import os
-from utils.utils import read_from_json, write_to_json
+from src.data.item_store import ItemStoreWriter
+from src.utils.utils import iter_json_object, iter_shards, parallel_map, read_from_json, write_to_json
+
+# Raw items are handed to the worker processes in shards of this many items.
+SHARD_SIZE = 1000
+
+DATA_TYPES = ('item', 'genre', 'performer', 'member', 'country', 'instrument')
+
+
+class DetailsIndex:
+    """
+    In-memory index of the labels of the Wikidata entities referenced by the extracted items,
+    with one map from Wikidata ID to label per type of information (e.g. genre, performer).
+
+    The index is built in a single pass over the items, and can be written to and read from the
+    `*_details.json` files so that later stages can either reuse it or load it.
+    """
+
+    def __init__(self, data_types: tuple = DATA_TYPES):
+        self.maps = {data_type: {} for data_type in data_types}
+
+    def __getitem__(self, data_type: str) -> dict:
+        return self.maps[data_type]
+
+    def add(self, extracted: dict) -> None:
+        """
+        Routes the `*_wikidata`/label pairs of an item into the maps of all their types at once.
+
+        Args:
+            extracted (dict): The data extracted for one item, as returned by `extract_data`.
+        """
+        visited = set()
+        for item_data in extracted.values():
+            # `extract_data` shares the same properties between all the types of an item.
+            if id(item_data) in visited:
+                continue
+            visited.add(id(item_data))
+            if not any("wikidata" in label for label in item_data):
+                continue
+            for data_type, data_map in self.maps.items():
+                if data_type in item_data:
+                    data_map.update(zip(item_data[f"{data_type}_wikidata"], item_data[data_type]))
+
+    def write(self, directory: str) -> None:
+        """Writes every map to the `{data_type}_details.json` file in the given directory."""
+        for data_type, data_map in self.maps.items():
+            data_map.pop(None, None)
+            write_to_json(data_map, os.path.join(directory, f"{data_type}_details.json"))
+
+    @classmethod
+    def load(cls, directory: str, data_types: tuple = DATA_TYPES):
+        """Reads an index written by `write` from the given directory."""
+        index = cls(data_types)
+        for data_type in data_types:
+            index.maps[data_type] = read_from_json(os.path.join(directory, f"{data_type}_details.json"))
+        return index
+
 
-     
 def extract_data(results: list[dict]) -> dict:
     """
     Extracts relevant data from the results obtained from a SPARQL query.
@@ -29,56 +85,78 @@ def extract_data(results: list[dict]) -> dict:
     return extracted_data
 
 
-def main():
+def extract_shard(shard: list[tuple]) -> list[tuple]:
+    """
+    Extracts the data of a shard of raw items.
+
+    Args:
+        shard (list of tuple): `(item_code, results)` pairs read from the raw details file.
+
+    Returns:
+        list of tuple: `(item_code, extracted)` pairs, in the same order, where `extracted` is
+            the output of `extract_data`.
+    """
+    return [(label, extract_data(results['results']['bindings'])) for label, results in shard]
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """
+    Parses the command line options of the extraction script.
+
+    Args:
+        argv (list): The arguments to parse. Defaults to `sys.argv[1:]`.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+    parser = argparse.ArgumentParser(description="Extract the relevant data from the raw Wikidata details.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes extracting shards of items in parallel")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
     """
     Orchestrates heavy metal data extraction from Wikidata files.
 
-    Reads data from a JSON file containing SPARQL query results, extracts relevant information, 
+    Streams data from a JSON file containing SPARQL query results, extracts relevant information,
     organizes it into dictionaries based on type of information, and writes the extracted data into separate JSON files.
 
     The process involves the following steps:
-    1. Reading data from the 'metal_item_details.json' file, from the `data/raw` directory.
-    2. Extracting relevant data from the results obtained.
-    3. Organizing the extracted data into dictionaries based on type of information (e.g., items, genres, performers).
-    4. Writing the organized data into separate JSON files for each dictionary.
-    5. Writing the overall extracted data into the 'metal_items.json' file, in the `data/processed` directory.
+    1. Reading data from the 'metal_item_details.json' file, from the `data/raw` directory, one item at a time.
+    2. Extracting relevant data from the results obtained for the item.
+    3. Indexing the labels referenced by the item by type of information (e.g., items, genres, performers).
+    4. Appending the extracted data of the item to the `detailed_items` columnar store, in the `data/processed`
+       directory (see `item_store.ItemStoreWriter`).
+    5. Writing the label index into separate JSON files for each type of information.
+
+    With `--workers`, the items are extracted by several processes in shards of `SHARD_SIZE` items,
+    and the results are merged in file order, so the output is identical to a serial run.
+
+    Only one item and the label dictionaries are held in memory at any time, besides the integer
+    offsets of the store, so the raw file does not need to fit in memory: the string columns of
+    the store are appended to their files as items arrive.
 
     Note: This function assumes that the 'metal_item_details.json' file contains the SPARQL query results 
     obtained from Wikidata, formatted as JSON.
 
+    Returns:
+        DetailsIndex: The label index, for later stages to reuse without reading it back.
     """
+    args = parse_args(argv)
     if not os.path.isdir("data/processed/"):
         os.mkdir("data/processed/")
 
-    raw_results = read_from_json('data/raw/metal_item_details.json')
-
-    result_dict = {}
-
-    item_dict = {}
-    genre_dict = {}
-    performer_dict = {}
-    member_dict = {}
-    country_dict = {}
-    instrument_dict = {}
-    collection_dict = {'item': item_dict, 'genre': genre_dict, 'performer': performer_dict,
-                       'member': member_dict, 'country': country_dict, 'instrument': instrument_dict}
-
-    for label, results in raw_results.items():
-        result_dict[label] = extract_data(results['results']['bindings'])
-
-    # Loop through the result items and assign item to correct dictionary according to type,
-    # using ID from Wikidata as key for the item and the label as its value.
-    for data_type, data_dict in collection_dict.items():
-        for _, value in result_dict.items():
-            for _, v in value.items():
-                if any("wikidata" in word for word in v.keys()) and data_type in v.keys():
-                    data_dict.update(dict(zip(v.get(f"{data_type}_wikidata").keys(), v.get(data_type, {}).keys())))
-    
-    for data_type, data_dict in collection_dict.items():
-        data_dict.pop(None, None)
-        write_to_json(data_dict, f"data/processed/{data_type}_details.json")
-
-    write_to_json(result_dict, "data/processed/detailed_items.json")
+    index = DetailsIndex()
+    shards = iter_shards(iter_json_object('data/raw/metal_item_details.json'), SHARD_SIZE)
+    with ItemStoreWriter("data/processed/detailed_items") as writer:
+        for extracted_shard in parallel_map(extract_shard, shards, args.workers):
+            for label, extracted in extracted_shard:
+                writer.add(label, extracted)
+                index.add(extracted)
+
+    index.write("data/processed/")
+    return index
 
 
 if __name__ == "__main__":
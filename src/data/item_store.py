@@ -0,0 +1,199 @@
+import os
+import shutil
+import numpy as np
+
+from array import array
+
+STRING_COLUMNS = ('items', 'types', 'properties', 'values')
+# Each offsets array has one more entry than the column it partitions, CSR style:
+# the entries of row `i` span `column[offsets[i]:offsets[i + 1]]`.
+OFFSET_COLUMNS = {'type_offsets': 'items', 'property_offsets': 'items', 'value_offsets': 'properties'}
+
+
+def _save_raw(raw_path: str, npy_path: str, dtype) -> None:
+    """
+    Turns a file of raw array items into a `.npy` file, as `np.save` would have written the
+    array, streaming the items instead of loading them.
+    """
+    dtype = np.dtype(dtype)
+    header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+              'shape': (os.path.getsize(raw_path) // dtype.itemsize,)}
+    with open(raw_path, 'rb') as raw_file, open(npy_path, 'wb') as npy_file:
+        np.lib.format.write_array_header_1_0(npy_file, header)
+        shutil.copyfileobj(raw_file, npy_file)
+    os.remove(raw_path)
+
+
+class ItemStoreWriter:
+    """
+    Writes extracted items to a columnar store, a directory of NumPy arrays.
+
+    Instead of nesting dictionaries whose values are empty dictionaries, the store keeps flat
+    string columns (item codes, the types of each item, its property labels and their values)
+    and integer offset columns linking every item to its types and properties and every
+    property to its values.
+
+    Every string column is saved as one NUL-separated UTF-8 blob plus the byte offset at which
+    every string starts, so that the column can be split in one go or sliced from a memory map.
+    The blobs and their start offsets are appended to temporary files as items are added, so
+    only the integer offset columns are held in memory, as compact arrays, until they are
+    written on exit.
+
+    Usage:
+        with ItemStoreWriter("data/processed/detailed_items") as writer:
+            writer.add(item_code, extract_data(bindings))
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.blobs = {name: open(self._temp_path(name), 'wb') for name in STRING_COLUMNS}
+        self.starts = {name: open(self._temp_path(f'{name}_starts'), 'wb') for name in STRING_COLUMNS}
+        self.sizes = {name: 0 for name in STRING_COLUMNS}
+        self.counts = {name: 0 for name in STRING_COLUMNS}
+        for starts in self.starts.values():
+            starts.write(np.int64(0).tobytes())
+        self.offsets = {name: array('q', [0]) for name in OFFSET_COLUMNS}
+
+    def _temp_path(self, name: str) -> str:
+        return os.path.join(self.directory, f'{name}.tmp')
+
+    def __enter__(self):
+        return self
+
+    def _append(self, column: str, strings) -> None:
+        for string in strings:
+            encoded = string.encode('utf-8') + b'\0'
+            self.blobs[column].write(encoded)
+            self.sizes[column] += len(encoded)
+            self.counts[column] += 1
+            self.starts[column].write(np.int64(self.sizes[column]).tobytes())
+
+    def add(self, item_code: str, extracted: dict) -> None:
+        """
+        Appends an item to the store.
+
+        Args:
+            item_code (str): The Wikidata ID of the item.
+            extracted (dict): The data extracted for the item, as returned by `extract_data`.
+        """
+        self._append('items', [item_code])
+        self._append('types', extracted.keys())
+        self.offsets['type_offsets'].append(self.counts['types'])
+        # `extract_data` shares the same properties between all the types of an item.
+        properties = next(iter(extracted.values()), {})
+        for label, values in properties.items():
+            self._append('properties', [label])
+            self._append('values', values.keys())
+            self.offsets['value_offsets'].append(self.counts['values'])
+        self.offsets['property_offsets'].append(self.counts['properties'])
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for name in STRING_COLUMNS:
+            # The blob always ends with a separator, which also keeps it memory-mappable when empty.
+            if exc_type is None and not self.counts[name]:
+                self.blobs[name].write(b'\0')
+            self.blobs[name].close()
+            self.starts[name].close()
+        if exc_type is not None:
+            for name in STRING_COLUMNS:
+                os.remove(self._temp_path(name))
+                os.remove(self._temp_path(f'{name}_starts'))
+            return
+        for name in STRING_COLUMNS:
+            _save_raw(self._temp_path(name), os.path.join(self.directory, f'{name}.npy'), np.uint8)
+            _save_raw(self._temp_path(f'{name}_starts'), os.path.join(self.directory, f'{name}_starts.npy'),
+                      np.int64)
+        for name, offsets in self.offsets.items():
+            np.save(os.path.join(self.directory, f'{name}.npy'), np.asarray(offsets, dtype=np.int64))
+
+
+class ItemStore:
+    """
+    Reads a columnar store written by `ItemStoreWriter`.
+
+    The arrays are memory-mapped by default, so opening the store is cheap and iterating over
+    it only pages in the items being read.
+    """
+
+    def __init__(self, directory: str, mmap: bool = True):
+        mmap_mode = 'r' if mmap else None
+
+        def load(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+
+        self.blobs = {name: load(name) for name in STRING_COLUMNS}
+        self.starts = {name: load(f'{name}_starts') for name in STRING_COLUMNS}
+        self.offsets = {name: load(name) for name in OFFSET_COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.starts['items']) - 1
+
+    def _string(self, column: str, i: int) -> str:
+        start, end = self.starts[column][i], self.starts[column][i + 1] - 1
+        return self.blobs[column][start:end].tobytes().decode('utf-8')
+
+    def _strings(self, column: str) -> list:
+        """Decodes a whole string column at once."""
+        blob = self.blobs[column].tobytes().decode('utf-8')
+        return blob.split('\0')[:len(self.starts[column]) - 1]
+
+    def __iter__(self):
+        """
+        Iterates over the items one at a time.
+
+        Yields:
+            tuple: `(item_code, item)`, where `item` is formatted like `format_items` formats it.
+        """
+        type_offsets = self.offsets['type_offsets']
+        property_offsets = self.offsets['property_offsets']
+        value_offsets = self.offsets['value_offsets']
+        for i in range(len(self)):
+            properties = {}
+            for p in range(property_offsets[i], property_offsets[i + 1]):
+                values = [self._string('values', v) for v in range(value_offsets[p], value_offsets[p + 1])]
+                properties[self._string('properties', p)] = values if len(values) > 1 else values[0]
+            types = (self._string('types', t) for t in range(type_offsets[i], type_offsets[i + 1]))
+            yield self._string('items', i), {item_type: properties for item_type in types}
+
+    def to_dict(self) -> dict:
+        """
+        Loads the whole store into the dictionary that `format_items` builds from the
+        `detailed_items.json` file, decoding every column in one go.
+
+        The formatted properties of an item are shared between all its types.
+
+        Returns:
+            dict: The formatted items, with item identifiers as keys.
+        """
+        items = self._strings('items')
+        types = self._strings('types')
+        properties = self._strings('properties')
+        values = self._strings('values')
+        type_offsets = self.offsets['type_offsets'].tolist()
+        property_offsets = self.offsets['property_offsets'].tolist()
+        value_offsets = self.offsets['value_offsets'].tolist()
+
+        formatted = {}
+        for i, item_code in enumerate(items):
+            item_properties = {}
+            for p in range(property_offsets[i], property_offsets[i + 1]):
+                start, end = value_offsets[p], value_offsets[p + 1]
+                item_properties[properties[p]] = values[start:end] if end - start > 1 else values[start]
+            formatted[item_code] = {item_type: item_properties
+                                    for item_type in types[type_offsets[i]:type_offsets[i + 1]]}
+        return formatted
+
+
+def load_formatted_items(directory: str) -> dict:
+    """
+    Loads the formatted items from a columnar store, replacing reading `detailed_items.json`
+    and formatting it with `format_items`.
+
+    Args:
+        directory (str): The directory of the store.
+
+    Returns:
+        dict: The formatted items, with item identifiers as keys.
+    """
+    return ItemStore(directory).to_dict()
@@ -1,3 +1,9 @@
+from src.utils.utils import iter_shards, parallel_map
+
+# Items are handed to the worker processes in shards of this many items.
+SHARD_SIZE = 1000
+
+
 def format_items(data: dict) -> dict:
     """
     Formats the items dictionary by removing empty dictionaries and converting
@@ -24,6 +30,88 @@ def format_items(data: dict) -> dict:
 
 
 
+def item_type(item_data: dict) -> str:
+    """
+    Returns the Wikidata type (instance of) of an item.
+
+    Items with several types are not classified, so that every processed item yields a
+    single row.
+
+    Args:
+        item_data (dict): The formatted data of an item.
+
+    Returns:
+        str: The Wikidata ID of the type of the item, or None if it has none or several.
+    """
+    for item in item_data.values():
+        item_wikidata = item.get("item_wikidata")
+        if isinstance(item_wikidata, str):
+            return item_wikidata
+    return None
+
+
+def index_item_types(data: dict, data_codes: dict) -> dict:
+    """
+    Partitions the items by entity type in a single pass, looking up the Wikidata type of every
+    item in a map from code to entity types built from the data codes.
+
+    Args:
+        data (dict): A dictionary containing the formatted items.
+        data_codes (dict): The contents of `config/data_codes.json`, where the codes of each
+            entity type are listed under `{entity}_codes`.
+
+    Returns:
+        dict: The item identifiers of each entity type (e.g. `musician`, `band`), in item order.
+            An item whose type is listed for several entity types is indexed under each of them.
+    """
+    entities_by_code = {}
+    for key, codes in data_codes.items():
+        if key.endswith("_codes"):
+            for code in codes:
+                entities_by_code.setdefault(code, []).append(key[:-len("_codes")])
+
+    index = {entity: [] for codes in entities_by_code.values() for entity in codes}
+    for item_code, item_data in data.items():
+        for entity in entities_by_code.get(item_type(item_data), ()):
+            index[entity].append(item_code)
+    return index
+
+
+def select_items(data: dict, codes: list) -> list:
+    """
+    Selects the items with any of the given Wikidata types.
+
+    Args:
+        data (dict): A dictionary containing the formatted items.
+        codes (list): The Wikidata IDs of the types to select.
+
+    Returns:
+        list: The identifiers of the selected items, in item order.
+    """
+    codes = set(codes)
+    return [item_code for item_code, item_data in data.items() if item_type(item_data) in codes]
+
+
+def format_items_parallel(data: dict, workers: int = 1, shard_size: int = SHARD_SIZE) -> dict:
+    """
+    Formats the items dictionary like `format_items`, with shards of items formatted by
+    several worker processes and merged back in the original order.
+
+    Args:
+        data (dict): A dictionary containing item data.
+        workers (int): The number of worker processes.
+        shard_size (int): The number of items per shard.
+
+    Returns:
+        dict: A formatted dictionary containing item data, identical to `format_items(data)`.
+    """
+    shards = (dict(shard) for shard in iter_shards(data.items(), shard_size))
+    new_data = {}
+    for formatted in parallel_map(format_items, shards, workers):
+        new_data.update(formatted)
+    return new_data
+
+
 def process_genre(data: dict, genres: list) -> list[tuple]:
     """
     Processes genre data from the provided dictionary and filters genres containing
@@ -43,7 +131,7 @@ def process_genre(data: dict, genres: list) -> list[tuple]:
     return genre_data
 
 
-def process_musician(data: dict, labels: dict, musician_codes: list) -> list[tuple]:
+def process_musician(data: dict, labels: dict, musician_codes: list, item_codes: list = None) -> list[tuple]:
     """
     Processes musician data from the provided dictionary.
 
@@ -51,41 +139,58 @@ def process_musician(data: dict, labels: dict, musician_codes: list) -> list[tup
         data (dict): A dictionary containing data about musicians.
         labels (dict): A dictionary containing label data for musician IDs.
         musician_codes (list): A list of musician codes to filter musicians by.
+        item_codes (list): The identifiers of the musicians, as indexed by `index_item_types`.
+            Selected from `data` with `musician_codes` if not given.
     
     Returns:
         A list of tuples containing filtered musician data formatted for feeding the `musician`
         table in the `metal_db` database.
     """
-    
+    if item_codes is None:
+        item_codes = select_items(data, musician_codes)
+
     musician_data = [
-        tuple(
-            [
-                item_code,  # Wikidata_id
-                labels.get(item_code, ""),  # Name
-                *(
-                    # If only one instrument, extract it from the list and pad with None
-                    [instrument] + [None] * (5 - 1) if isinstance(instrument, str) else
-                    # If multiple instruments, use them and pad with None
-                    instrument + [None] * (5 - len(instrument)) if isinstance(instrument, list) else
-                    # If no instrument, fill with None
-                    [None] * 5
-                )
-            ][:7]
+        (
+            item_code,  # Wikidata_id
+            labels.get(item_code, ""),  # Name
         )
-    # Iterate over each item in the items dictionary
-    # and filter items based on the condition
-    for item_code, item_data in data.items()
-    if any(
-        code in (item_data.get(idx, {}).get("item_wikidata", "") for idx in item_data.keys())
-        for code in musician_codes
-    )
-    # Extract the instrument value from the inner dictionary
-    for instrument in (item.get("instrument") for item in item_data.values())
+    # Iterate over each musician in the items dictionary
+    for item_code in item_codes
+    for _ in data[item_code].values()
     ]
     return musician_data
 
 
-def process_band(data: dict, labels: dict, band_codes: list) -> list[tuple]:
+def process_musician_instruments(data: dict, musician_codes: list, item_codes: list = None) -> list[tuple]:
+    """
+    Processes the instruments played by musicians from the provided dictionary.
+
+    Args:
+        data (dict): A dictionary containing data about musicians.
+        musician_codes (list): A list of musician codes to filter musicians by.
+        item_codes (list): The identifiers of the musicians, as indexed by `index_item_types`.
+            Selected from `data` with `musician_codes` if not given.
+
+    Returns:
+        A list of `(musician wikidata_id, instrument)` tuples, one per instrument of every
+        musician, for feeding the `musician_instrument` table in the `metal_db` database.
+    """
+    if item_codes is None:
+        item_codes = select_items(data, musician_codes)
+
+    instrument_data = []
+    for item_code in item_codes:
+        instruments = {}
+        for item in data[item_code].values():
+            instrument = item.get("instrument")
+            # Keep the order of the instruments, without repeating the ones shared by several types
+            instruments.update(dict.fromkeys(instrument if isinstance(instrument, list) else
+                                             [instrument] if isinstance(instrument, str) else []))
+        instrument_data.extend((item_code, instrument) for instrument in instruments)
+    return instrument_data
+
+
+def process_band(data: dict, labels: dict, band_codes: list, item_codes: list = None) -> list[tuple]:
     """
     Processes band data from the provided dictionary and filters bands from
     specific categories.
@@ -94,11 +199,16 @@ def process_band(data: dict, labels: dict, band_codes: list) -> list[tuple]:
         data (dict): A dictionary containing band data.
         labels (dict): A dictionary containing label data for band IDs.
         band_codes (list): A list of band codes to filter bands by.
+        item_codes (list): The identifiers of the bands, as indexed by `index_item_types`.
+            Selected from `data` with `band_codes` if not given.
     
     Returns:
         A list of tuples containing filtered band data formatted for feeding the `band`
         table in the `metal_db` database.
     """
+    if item_codes is None:
+        item_codes = select_items(data, band_codes)
+
     band_data = [
     (
         labels.get(item_code, ""),
@@ -113,15 +223,13 @@ def process_band(data: dict, labels: dict, band_codes: list) -> list[tuple]:
         item.get("end", " ")[-1] if isinstance(item.get("end"), list) else \
             None
     )
-    for item_code, item_data in data.items()
-    for item in item_data.values()
-    if any(code in (item_data.get(idx, {}).get("item_wikidata", "") for idx in item_data.keys()) \
-           for code in band_codes)
+    for item_code in item_codes
+    for item in data[item_code].values()
 ]
     return band_data
 
 
-def process_album(data: dict, labels: dict, album_codes: list) -> list[tuple]:
+def process_album(data: dict, labels: dict, album_codes: list, item_codes: list = None) -> list[tuple]:
     """
     Processes album data from the provided dictionary and filters albums from
     specific categories.
@@ -130,11 +238,16 @@ def process_album(data: dict, labels: dict, album_codes: list) -> list[tuple]:
         data (dict): A dictionary containing album data.
         labels (dict): A dictionary containing label data for album IDs.
         album_codes (list): A list of album codes to filter albums by.
+        item_codes (list): The identifiers of the albums, as indexed by `index_item_types`.
+            Selected from `data` with `album_codes` if not given.
     
     Returns:
         A list of tuples containing filtered album data formatted for feeding the `album`
         table in the `metal_db` database.
     """
+    if item_codes is None:
+        item_codes = select_items(data, album_codes)
+
     album_data = [
     (
         labels.get(item_code, "")[:100],
@@ -152,15 +265,13 @@ def process_album(data: dict, labels: dict, album_codes: list) -> list[tuple]:
             None,
         item_code
     )
-    for item_code, item_data in data.items()
-    for item in item_data.values()
-    if any(code in (item_data.get(idx, {}).get("item_wikidata", "") \
-           for idx in item_data.keys()) for code in album_codes)
+    for item_code in item_codes
+    for item in data[item_code].values()
     ]
     return album_data
 
 
-def process_song(data: dict, labels: dict, song_codes: list) -> list[tuple]:
+def process_song(data: dict, labels: dict, song_codes: list, item_codes: list = None) -> list[tuple]:
     """
     Processes song data from the provided dictionary and filters songs from
     specific categories.
@@ -169,11 +280,16 @@ def process_song(data: dict, labels: dict, song_codes: list) -> list[tuple]:
         data (dict): A dictionary containing song data.
         labels (dict): A dictionary containing label data for song IDs.
         song_codes (list): A list of song codes to filter songs by.
+        item_codes (list): The identifiers of the songs, as indexed by `index_item_types`.
+            Selected from `data` with `song_codes` if not given.
     
     Returns:
         A list of tuples containing filtered song data formatted for feeding the `song`
         table in the `metal_db` database.
     """
+    if item_codes is None:
+        item_codes = select_items(data, song_codes)
+
     song_data = [
     (
         labels.get(item_code, "")[:50],
@@ -188,10 +304,8 @@ def process_song(data: dict, labels: dict, song_codes: list) -> list[tuple]:
             None,
         item_code
     )
-    for item_code, item_data in data.items()
-    for item in item_data.values()
-    if any(code in (item_data.get(idx, {}).get("item_wikidata", "") \
-           for idx in item_data.keys()) for code in song_codes)
+    for item_code in item_codes
+    for item in data[item_code].values()
     ]
     return song_data
 
@@ -0,0 +1,149 @@
+import pandas as pd
+
+from src.data.process_data import select_items
+
+ROW_INDEX = ['item', 'type']
+
+
+def items_to_frame(data: dict, item_codes: list) -> pd.DataFrame:
+    """
+    Flattens formatted items into a long DataFrame with one (item, property, value) triple per row.
+
+    Args:
+        data (dict): A dictionary containing the formatted items.
+        item_codes (list): The identifiers of the items to include.
+
+    Returns:
+        pd.DataFrame: A DataFrame with the columns `item`, `type` (the key of the inner
+            dictionary the value comes from), `property`, `position` (the position of the
+            value among the values of the property) and `value`.
+    """
+    records = []
+    for item_code in item_codes:
+        for item_type, item in data[item_code].items():
+            for prop, values in item.items():
+                if isinstance(values, list):
+                    records.extend((item_code, item_type, prop, position, value)
+                                   for position, value in enumerate(values))
+                else:
+                    records.append((item_code, item_type, prop, 0, values))
+    return pd.DataFrame.from_records(records, columns=['item', 'type', 'property', 'position', 'value'])
+
+
+def row_keys(data: dict, item_codes: list) -> pd.DataFrame:
+    """Lists the (item, type) pairs that become table rows, in the order of the Python engine."""
+    keys = [(item_code, item_type) for item_code in item_codes for item_type in data[item_code]]
+    return pd.DataFrame.from_records(keys, columns=ROW_INDEX)
+
+
+def aggregate_values(frame: pd.DataFrame, keys: pd.DataFrame, properties: list, how: str) -> pd.DataFrame:
+    """
+    Reduces the values of some properties to one value per row key.
+
+    Args:
+        frame (pd.DataFrame): The long DataFrame built by `items_to_frame`.
+        keys (pd.DataFrame): The row keys built by `row_keys`.
+        properties (list): The properties to reduce, one output column each.
+        how (str): `first` or `last`, the value to keep among the values of a property.
+
+    Returns:
+        pd.DataFrame: One row per row key, in order, with NaN where a property has no value.
+    """
+    values = frame[frame['property'].isin(properties)].groupby(ROW_INDEX + ['property'], sort=False)['value']
+    values = values.agg(how).unstack('property').reindex(columns=properties)
+    return values.reindex(pd.MultiIndex.from_frame(keys))
+
+
+def to_rows(columns: list) -> list[tuple]:
+    """Zips columns into row tuples, replacing missing values with None."""
+    converted = []
+    for column in columns:
+        column = pd.Series(column, dtype=object)
+        converted.append(column.where(column.notna(), None).tolist())
+    return list(zip(*converted))
+
+
+def _labels(keys: pd.DataFrame, labels: dict, max_length: int = None) -> pd.Series:
+    names = keys['item'].map(labels).fillna("")
+    return names.str.slice(0, max_length) if max_length is not None else names
+
+
+def process_musician_frame(data: dict, labels: dict, musician_codes: list, item_codes: list = None) -> list[tuple]:
+    """
+    Processes musician data like `process_data.process_musician`, with DataFrame operations.
+
+    Returns:
+        The same list of tuples as `process_data.process_musician`.
+    """
+    if item_codes is None:
+        item_codes = select_items(data, musician_codes)
+    keys = row_keys(data, item_codes)
+    return to_rows([keys['item'], _labels(keys, labels)])
+
+
+def process_musician_instruments_frame(data: dict, musician_codes: list, item_codes: list = None) -> list[tuple]:
+    """
+    Processes the instruments of musicians like `process_data.process_musician_instruments`,
+    with DataFrame operations.
+
+    Returns:
+        The same list of tuples as `process_data.process_musician_instruments`.
+    """
+    if item_codes is None:
+        item_codes = select_items(data, musician_codes)
+    frame = items_to_frame(data, item_codes)
+    instruments = frame.loc[frame['property'] == 'instrument', ['item', 'value']].drop_duplicates()
+    return to_rows([instruments['item'], instruments['value']])
+
+
+def process_band_frame(data: dict, labels: dict, band_codes: list, item_codes: list = None) -> list[tuple]:
+    """
+    Processes band data like `process_data.process_band`, with DataFrame operations.
+
+    Returns:
+        The same list of tuples as `process_data.process_band`.
+    """
+    if item_codes is None:
+        item_codes = select_items(data, band_codes)
+    frame = items_to_frame(data, item_codes)
+    keys = row_keys(data, item_codes)
+
+    first = aggregate_values(frame, keys, ['country', 'start'], 'first')
+    last = aggregate_values(frame, keys, ['end'], 'last')
+    return to_rows([_labels(keys, labels), first['country'].to_numpy(), keys['item'],
+                    first['start'].to_numpy(), last['end'].to_numpy()])
+
+
+def process_album_frame(data: dict, labels: dict, album_codes: list, item_codes: list = None) -> list[tuple]:
+    """
+    Processes album data like `process_data.process_album`, with DataFrame operations.
+
+    Returns:
+        The same list of tuples as `process_data.process_album`.
+    """
+    if item_codes is None:
+        item_codes = select_items(data, album_codes)
+    frame = items_to_frame(data, item_codes)
+    keys = row_keys(data, item_codes)
+
+    first = aggregate_values(frame, keys, ['performer_wikidata', 'publicationdate', 'duration', 'item'], 'first')
+    return to_rows([_labels(keys, labels, 100), first['performer_wikidata'].to_numpy(),
+                    first['publicationdate'].to_numpy(), first['duration'].to_numpy(),
+                    first['item'].to_numpy(), keys['item']])
+
+
+def process_song_frame(data: dict, labels: dict, song_codes: list, item_codes: list = None) -> list[tuple]:
+    """
+    Processes song data like `process_data.process_song`, with DataFrame operations.
+
+    Returns:
+        The same list of tuples as `process_data.process_song`.
+    """
+    if item_codes is None:
+        item_codes = select_items(data, song_codes)
+    frame = items_to_frame(data, item_codes)
+    keys = row_keys(data, item_codes)
+
+    first = aggregate_values(frame, keys, ['performer_wikidata', 'album_wikidata', 'duration'], 'first')
+    return to_rows([_labels(keys, labels, 50), first['performer_wikidata'].to_numpy(),
+                    first['album_wikidata'].to_numpy(), first['duration'].to_numpy(), keys['item']])
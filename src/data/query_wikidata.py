@@ -1,46 +1,235 @@
-import sys
+import argparse
+import http.client
+import json
 import os
+import random
+import sys
+import threading
+import time
 import urllib.error
+import urllib.parse
 
-from SPARQLWrapper import SPARQLWrapper, JSON
+from collections import deque
+from datetime import datetime, timezone
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from tqdm import tqdm
 
-from src.utils.utils import read_from_json, write_to_json
+from src.utils.cache import DiskCache, make_key
+from src.utils.utils import JsonObjectWriter, iter_jsonl, read_from_json, write_to_json
 
 endpoint_url = "https://query.wikidata.org/sparql"
+labels_file = "data/raw/metal_item_labels.json"
+details_file = "data/raw/metal_item_details.json"
+journal_file = "data/raw/metal_item_details.jsonl"
+crawl_state_file = "data/raw/crawl_state.json"
+sync_state_file = "data/raw/sync_state.json"
+changes_file = "data/raw/changes.json"
+user_agent = "MetalProject/0.1 %s.%s" % (sys.version_info[0], sys.version_info[1])
+
+# Wikidata allows five concurrent queries per client, so these defaults stay within its limits.
+MAX_WORKERS = 5
+REQUESTS_PER_SECOND = 5.0
+MAX_RETRIES = 5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Above Wikidata's 60 second query limit, so that the server's timeout normally arrives first.
+REQUEST_TIMEOUT = 75
+
+# Batched detail queries start at BATCH_SIZE items and adapt between 1 and MAX_BATCH_SIZE.
+BATCH_SIZE = 100
+MAX_BATCH_SIZE = 400
+# Wikidata reports query timeouts as HTTP 500 (or 504 from the proxy), which batching handles
+# by shrinking the batch rather than by retrying the same query.
+TIMEOUT_STATUSES = (500, 504)
+# Modification dates are small results, so they are requested for many items at once.
+MODIFIED_BATCH_SIZE = 500
+
+# Responses are cached on disk for a time that depends on how often each kind of query changes.
+CACHE_DIR = "data/cache/wikidata"
+CACHE_SIZE_MB = 2048
+DAY = 24 * 60 * 60
+CACHE_TTL = {
+    'query_genre': 30 * DAY,
+    'query_items': 7 * DAY,
+    'query_details': 7 * DAY,
+}
+
+# Shared by every worker thread; set from the command line in `main`.
+rate_limiter = None
+response_cache = None
+offline = False
+_local = threading.local()
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the rate at which requests are sent to the endpoint.
+
+    Tokens are refilled continuously at `rate` per second up to `capacity`, and every
+    request consumes one token, blocking until one is available.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Blocks until a token is available and consumes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def get_connection(endpoint_url: str) -> http.client.HTTPConnection:
+    """
+    Returns the persistent HTTP connection to the endpoint owned by the calling thread,
+    opening it on first use so that consecutive queries reuse the same socket.
 
+    Args:
+        endpoint_url (str): The URL of the SPARQL endpoint.
 
-def execute_query(endpoint_url: str, query: str) -> dict:
+    Returns:
+        http.client.HTTPConnection: A keep-alive connection to the endpoint host.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    url = urllib.parse.urlsplit(endpoint_url)
+    if url.netloc not in connections:
+        connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        connections[url.netloc] = connection_class(url.netloc, timeout=REQUEST_TIMEOUT)
+    return connections[url.netloc]
+
+
+def close_connection(endpoint_url: str) -> None:
+    """Closes and forgets the calling thread's connection to the endpoint."""
+    connections = getattr(_local, "connections", {})
+    connection = connections.pop(urllib.parse.urlsplit(endpoint_url).netloc, None)
+    if connection is not None:
+        connection.close()
+
+
+def execute_query(endpoint_url: str, query: str, retry_statuses: tuple = RETRY_STATUSES,
+                  query_type: str = None) -> dict:
     """
     Executes a SPARQL query against the specified endpoint URL and returns the results.
 
+    When a response cache is set, the results are looked up by a hash of the endpoint and the
+    query text first, and fresh results are stored in it. In offline mode, queries missing from
+    the cache fail instead of reaching the endpoint.
+
     Args:
         endpoint_url (str): The URL of the SPARQL endpoint to query.
         query (str): The SPARQL query string to execute.
+        retry_statuses (tuple): The HTTP statuses on which the query is retried.
+        query_type (str): The name of the query template in `config/queries.json`, which sets
+            how long its cached results stay fresh. Results of other queries never expire.
 
     Returns:
         dict: A dictionary containing the results of the SPARQL query.
+
+    Raises:
+        urllib.error.URLError: If the query is not cached while running offline.
+        urllib.error.HTTPError: See `send_query`.
     """
-    user_agent = "MetalProject/0.1 %s.%s" % (sys.version_info[0], sys.version_info[1])
-    sparql = SPARQLWrapper(endpoint_url, agent=user_agent)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    return sparql.query().convert()
+    if response_cache is not None:
+        key = make_key(endpoint_url, query)
+        results = response_cache.get(key, CACHE_TTL.get(query_type))
+        if results is not None:
+            return results
+    if offline:
+        raise urllib.error.URLError("query not found in the response cache while running offline")
+    results = send_query(endpoint_url, query, retry_statuses)
+    if response_cache is not None:
+        response_cache.put(key, results)
+    return results
+
+
+def send_query(endpoint_url: str, query: str, retry_statuses: tuple = RETRY_STATUSES) -> dict:
+    """
+    Sends a SPARQL query to the specified endpoint URL and returns the results.
+
+    The query is sent over the calling thread's persistent connection, throttled by the
+    module's rate limiter when one is set, and retried with exponential backoff when the
+    endpoint answers with HTTP 429 or a 5xx status. When `retry_statuses` leaves out the
+    timeout statuses, a request that times out on the client side is not retried either.
+
+    Args:
+        endpoint_url (str): The URL of the SPARQL endpoint to query.
+        query (str): The SPARQL query string to execute.
+        retry_statuses (tuple): The HTTP statuses on which the query is retried.
 
+    Returns:
+        dict: A dictionary containing the results of the SPARQL query.
 
-def fetch_items_from_query(query: str, query_parameters: dict) -> dict:
+    Raises:
+        urllib.error.HTTPError: If the endpoint keeps failing after all retries, or
+            answers with a status that is not worth retrying.
+        TimeoutError: If the request times out and timeouts are not retried.
+    """
+    url = urllib.parse.urlsplit(endpoint_url)
+    body = urllib.parse.urlencode({"query": query, "format": "json"})
+    headers = {
+        "User-Agent": user_agent,
+        "Accept": "application/sparql-results+json",
+        "Content-Type": "application/x-www-form-urlencoded",
+    }
+    for attempt in range(MAX_RETRIES + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        connection = get_connection(endpoint_url)
+        try:
+            connection.request("POST", url.path or "/", body=body.encode("utf-8"), headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+        except (http.client.HTTPException, OSError) as e:
+            # Stale keep-alive sockets are dropped by the server; reconnect and try again.
+            close_connection(endpoint_url)
+            if attempt == MAX_RETRIES or (isinstance(e, TimeoutError)
+                                          and not set(TIMEOUT_STATUSES) & set(retry_statuses)):
+                raise
+            time.sleep(2 ** attempt + random.random())
+            continue
+
+        if response.status == 200:
+            return json.loads(payload)
+        error = urllib.error.HTTPError(endpoint_url, response.status, response.reason, response.headers, None)
+        if response.status not in retry_statuses or attempt == MAX_RETRIES:
+            raise error
+        retry_after = response.getheader("Retry-After")
+        delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt + random.random()
+        time.sleep(delay)
+
+
+def invalidate_query(query: str) -> None:
+    """Drops the cached results of a query, so that it is sent to the endpoint next time."""
+    if response_cache is not None:
+        response_cache.delete(make_key(endpoint_url, query))
+
+
+def fetch_items_from_query(query: str, query_parameters: dict, query_type: str = None) -> dict:
     """
     Executes a SPARQL query with the provided parameters to fetch items from Wikidata.
 
     Args:
         query (str): The SPARQL query template to execute, with placeholders for parameters.
         query_parameters (dict): A dictionary containing parameters to be substituted into the query.
+        query_type (str): The name of the query template, see `execute_query`.
 
     Returns:
         dict: A dictionary containing the results of the SPARQL query, with item identifiers as keys.
     """
     query = query.format(**query_parameters)
-    results = execute_query(endpoint_url, query)
+    results = execute_query(endpoint_url, query, query_type=query_type)
     return results
 
 
@@ -56,10 +245,186 @@ def fetch_item_details(item_query: str, item: str):
         dict: A dictionary containing the fetched details of the item, with the item identifier as the key.
     """
     query_parameters = {'item': item}
-    details = {item: fetch_items_from_query(item_query, query_parameters)}
+    details = {item: fetch_items_from_query(item_query, query_parameters, query_type='query_details')}
     return details
 
 
+def fetch_details_concurrently(item_query: str, items: list, max_workers: int = MAX_WORKERS):
+    """
+    Fetches the details of many items using a bounded pool of worker threads.
+
+    Args:
+        item_query (str): The SPARQL query template used to fetch the details of one item.
+        items (list): The identifiers of the items to fetch.
+        max_workers (int): The maximum number of queries in flight at the same time.
+
+    Yields:
+        tuple: `(item, details, error)` for every item as soon as its query finishes, where
+            `details` is the dictionary returned by `fetch_item_details` and `error` is the
+            exception raised while fetching it, if any.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_item_details, item_query, item): item for item in items}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                yield item, future.result(), None
+            except Exception as e:
+                yield item, None, e
+
+
+class AdaptiveBatchSize:
+    """
+    Batch size for the batched detail queries, halved whenever a batch times out and
+    grown by a quarter after every successful batch.
+    """
+
+    def __init__(self, size: int = BATCH_SIZE, min_size: int = 1, max_size: int = MAX_BATCH_SIZE):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = max(min_size, min(size, max_size))
+        self.lock = threading.Lock()
+
+    def grow(self) -> None:
+        with self.lock:
+            self.size = min(self.max_size, self.size + max(1, self.size // 4))
+
+    def shrink(self) -> None:
+        with self.lock:
+            self.size = max(self.min_size, self.size // 2)
+
+
+def is_timeout(error: Exception) -> bool:
+    """Tells whether an error raised by `execute_query` means that the query timed out."""
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code in TIMEOUT_STATUSES
+    return isinstance(error, TimeoutError)
+
+
+def fetch_batch_details(batch_query: str, items: list, item_query: str = None) -> dict:
+    """
+    Fetches the details of several items with a single query and splits the results per item.
+
+    Args:
+        batch_query (str): The SPARQL query template binding the requested items to `?entity`
+            through a `VALUES` clause.
+        items (list): The identifiers of the items to fetch.
+        item_query (str): The single-item query template equivalent to `batch_query`. When given,
+            the results of every item are cached as if they had been fetched with it, so that
+            the cache does not depend on how items were grouped into batches.
+
+    Returns:
+        dict: A dictionary with the item identifiers as keys and, as values, the same query
+            results that `fetch_item_details` returns for each of them.
+    """
+    query_parameters = {'items': ' '.join(f'wd:{item}' for item in items)}
+    if offline:
+        raise urllib.error.URLError("batched queries are not cached, cannot fetch them while running offline")
+    results = send_query(endpoint_url, batch_query.format(**query_parameters),
+                         retry_statuses=tuple(set(RETRY_STATUSES) - set(TIMEOUT_STATUSES)))
+    head = {'vars': [var for var in results['head']['vars'] if var != 'entity']}
+    details = {item: {'head': head, 'results': {'bindings': []}} for item in items}
+    for binding in results['results']['bindings']:
+        item = binding.pop('entity')['value'].split('/')[-1]
+        if item in details:
+            details[item]['results']['bindings'].append(binding)
+    if response_cache is not None and item_query is not None:
+        for item, results in details.items():
+            response_cache.put(make_key(endpoint_url, item_query.format(item=item)), results)
+    return details
+
+
+def fetch_details_batched(batch_query: str, items: list, batch_size: int = BATCH_SIZE,
+                          max_workers: int = MAX_WORKERS, item_query: str = None):
+    """
+    Fetches the details of many items with batched queries run by a bounded pool of worker threads.
+
+    Batches that time out are split again at the reduced batch size; items that still time out on
+    their own are reported as failed.
+
+    Args:
+        batch_query (str): The batched SPARQL query template, see `fetch_batch_details`.
+        items (list): The identifiers of the items to fetch.
+        batch_size (int): The initial number of items per query.
+        max_workers (int): The maximum number of queries in flight at the same time.
+        item_query (str): The equivalent single-item query template. When given, items cached
+            under it are served from the cache instead of being batched.
+
+    Yields:
+        tuple: `(item, details, error)` for every item, as `fetch_details_concurrently` does.
+    """
+    sizer = AdaptiveBatchSize(batch_size)
+    pending = deque()
+    for item in items:
+        cached = None
+        if response_cache is not None and item_query is not None:
+            cached = response_cache.get(make_key(endpoint_url, item_query.format(item=item)),
+                                        CACHE_TTL['query_details'])
+        if cached is not None:
+            yield item, {item: cached}, None
+        else:
+            pending.append(item)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            while pending and len(running) < max_workers:
+                batch = [pending.popleft() for _ in range(min(sizer.size, len(pending)))]
+                running[executor.submit(fetch_batch_details, batch_query, batch, item_query)] = batch
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = running.pop(future)
+                try:
+                    details = future.result()
+                except Exception as e:
+                    if is_timeout(e) and len(batch) > 1:
+                        sizer.shrink()
+                        pending.extendleft(reversed(batch))
+                        continue
+                    for item in batch:
+                        yield item, None, e
+                    continue
+                sizer.grow()
+                for item in batch:
+                    yield item, {item: details[item]}, None
+
+
+def fetch_modified_items(modified_query: str, items: list, since: str,
+                         batch_size: int = MODIFIED_BATCH_SIZE, max_workers: int = MAX_WORKERS) -> set:
+    """
+    Finds the items modified on Wikidata after a given time.
+
+    The `schema:dateModified` of the items is requested in batches, bypassing the response cache.
+    When a batch fails, all its items are assumed to have changed.
+
+    Args:
+        modified_query (str): The SPARQL query template returning the `?entity` among `{items}`
+            that were modified after `{since}`.
+        items (list): The identifiers of the items to check.
+        since (str): The ISO 8601 UTC time after which modifications count.
+        batch_size (int): The number of items checked per query.
+        max_workers (int): The maximum number of queries in flight at the same time.
+
+    Returns:
+        set: The identifiers of the modified items.
+    """
+    def fetch_batch(batch):
+        query = modified_query.format(items=' '.join(f'wd:{item}' for item in batch), since=since)
+        results = send_query(endpoint_url, query)
+        return {binding['entity']['value'].split('/')[-1] for binding in results['results']['bindings']}
+
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    modified = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            try:
+                modified.update(future.result())
+            except Exception as e:
+                print(f"Error fetching modification dates, refetching {len(futures[future])} items: {e}")
+                modified.update(futures[future])
+    return modified
+
+
 def parse_genre_results(genre_query: dict) -> list:
     """
     Extracts genre values from the results of a genre query.
@@ -88,7 +453,130 @@ def parse_item_results(item_query: dict) -> dict:
     return item_result
 
 
-def main():
+def open_journal(journal_path: str, resume: bool = False):
+    """
+    Opens the crawl journal, in which the details of every fetched item are appended as one
+    JSON line of the form `{"item": ..., "details": ...}`.
+
+    Args:
+        journal_path (str): The path to the journal file.
+        resume (bool): Whether to keep the records of a previous crawl. An incomplete last
+            record is truncated so that new records start on a line of their own.
+
+    Returns:
+        The journal file, opened for appending.
+    """
+    if resume and os.path.exists(journal_path):
+        with open(journal_path, "rb+") as journal:
+            content_end = journal.seek(0, os.SEEK_END)
+            position = content_end
+            while position > 0:
+                journal.seek(position - 1)
+                if journal.read(1) == b"\n":
+                    break
+                position -= 1
+            if position != content_end:
+                journal.truncate(position)
+        return open(journal_path, "a", encoding="utf-8")
+    return open(journal_path, "w", encoding="utf-8")
+
+
+def append_to_journal(journal, item: str, details: dict) -> None:
+    """Appends the details of an item to the crawl journal and flushes them to disk."""
+    journal.write(json.dumps({"item": item, "details": details}, ensure_ascii=False) + "\n")
+    journal.flush()
+
+
+def read_journal_items(journal_path: str) -> set:
+    """
+    Reads the identifiers of the items already recorded in the crawl journal.
+
+    Args:
+        journal_path (str): The path to the journal file.
+
+    Returns:
+        set: The identifiers of the journaled items, empty if there is no journal.
+    """
+    if not os.path.exists(journal_path):
+        return set()
+    return {record["item"] for record in iter_jsonl(journal_path)}
+
+
+def compact_journal(journal_path: str, output_path: str, item_order: list = None, base: dict = None) -> int:
+    """
+    Streams the crawl journal into a JSON file with the same shape as `metal_item_details.json`.
+
+    Only the byte offset of every record is kept in memory; the records themselves are read
+    back and written one at a time. When an item was journaled more than once, its last
+    record wins.
+
+    Args:
+        journal_path (str): The path to the journal file.
+        output_path (str): The path to the JSON file to write.
+        item_order (list): The order in which to write the items. Items missing from the
+            journal are skipped, and journaled items not listed are left out. Defaults to
+            the journal order.
+        base (dict): Details of a previous crawl, written for the listed items that are
+            missing from the journal.
+
+    Returns:
+        int: The number of items written.
+    """
+    offsets = {}
+    with open(journal_path, "rb") as journal:
+        position = journal.tell()
+        for line in iter(journal.readline, b""):
+            if not line.endswith(b"\n"):
+                break
+            offsets[json.loads(line)["item"]] = position
+            position = journal.tell()
+
+        if item_order is None:
+            item_order = sorted(offsets, key=offsets.get)
+        with JsonObjectWriter(output_path) as writer:
+            for item in item_order:
+                if item in offsets:
+                    journal.seek(offsets[item])
+                    writer.write(item, json.loads(journal.readline())["details"])
+                elif base is not None and item in base:
+                    writer.write(item, base[item])
+            return writer.count
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """
+    Parses the command line options of the data gathering script.
+
+    Args:
+        argv (list): The arguments to parse. Defaults to `sys.argv[1:]`.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+    parser = argparse.ArgumentParser(description="Download metal items and their details from Wikidata.")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="maximum number of detail queries in flight at the same time")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND,
+                        help="maximum number of requests sent per second")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="initial number of items per detail query, 0 to query items one by one")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--resume", action="store_true",
+                      help="continue an interrupted crawl, skipping the items already in the journal")
+    mode.add_argument("--incremental", action="store_true",
+                      help="only fetch the details of items that are new or were modified since the last crawl")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help="directory in which query responses are cached")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE_MB,
+                        help="maximum size of the response cache in megabytes")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always query Wikidata, without reading or writing the response cache")
+    parser.add_argument("--offline", action="store_true",
+                        help="replay a previous crawl from the response cache without querying Wikidata")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
     """
     Orchestrates the data gathering process for the MetalExplorer project.
 
@@ -98,45 +586,129 @@ def main():
 
     Usage:
         Run this script to initiate the data gathering process for the MetalExplorer project.
+        Use `--workers` and `--rate` to tune how hard the endpoint is queried, and `--batch-size`
+        to set how many items are requested per detail query. Fetched details are appended to a
+        journal as they arrive, and `--resume` continues an interrupted crawl from it, or one in
+        which some items failed, counting as having started when the interrupted crawl did.
+        Responses are cached under `data/cache/wikidata`, so `--offline` can replay a previous crawl.
+        `--incremental` refreshes a previous crawl by only fetching the details of new items and
+        of items modified since it, and records what changed in `data/raw/changes.json`. Items whose
+        details could not be fetched are listed in `data/raw/sync_state.json` and refetched by the
+        next incremental run.
 
     """
+    global rate_limiter, response_cache, offline
+    args = parse_args(argv)
+    rate_limiter = RateLimiter(args.rate)
+    if args.offline and args.no_cache:
+        print("Cannot run offline without the response cache.")
+        return
+    response_cache = DiskCache(args.cache_dir, args.cache_size * 2**20) if not args.no_cache else None
+    offline = args.offline
+
     if not os.path.isdir("config/"):
         os.mkdir("config/")
     queries = read_from_json('config/queries.json')
-    genre_results = execute_query(endpoint_url, queries['query_genre'])
-    genres = parse_genre_results(genre_results)
 
-    assorted_items = {}
-    for genre in genres:
-        try:
-            items = fetch_items_from_query(queries['query_items'], {'genre': genre})
-            items = parse_item_results(items)
-            assorted_items.update(items)
-        except urllib.error.HTTPError as e:
-            print(f"HTTP Error fetching items for genre '{genre}': {e}")
-        except Exception as e:
-            print(f"Error fetching items for genre '{genre}': {e}")
-    
-    if not os.path.isdir("data/raw/"):
-        os.mkdir("data/raw/")
-    write_to_json(assorted_items, "data/raw/metal_item_labels.json")
-
-    item_details = {}
-    save_threshold = 5
-    for item, _ in tqdm(assorted_items.items(), total=len(assorted_items)): 
-        try:
-            details = fetch_item_details(queries['query_details'], item)
-            item_details.update(details)
-            if (len(item_details) / len(assorted_items) * 100) > save_threshold:
-                write_to_json(item_details, "data/raw/metal_item_details_temp.json")
-                save_threshold += 5
-        except urllib.error.HTTPError as e:
-            print(f"HTTP Error fetching details for item '{item}': {e}")
-        except Exception as e:
-            print(f"Error fetching details for item '{item}': {e}")
-
-    write_to_json(item_details, "data/raw/metal_item_details.json")
-    os.remove("data/raw/metal_item_labels_temp.json")
+    sync_started = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    previous_items, previous_details, previous_failed = {}, None, []
+    if args.incremental:
+        if not (os.path.exists(sync_state_file) and os.path.exists(details_file)):
+            print("No previous crawl to refresh, run a full crawl first.")
+            return
+        previous_items = read_from_json(labels_file)
+        sync_state = read_from_json(sync_state_file)
+        last_sync = sync_state['last_sync']
+        # Items whose details could not be fetched last time, refetched whether modified or not
+        previous_failed = sync_state.get('failed', [])
+
+    os.makedirs("data/raw/", exist_ok=True)
+    if args.resume and os.path.exists(crawl_state_file):
+        # Items modified after the interrupted crawl started may have been journaled before the
+        # change, so the sync covers changes since the start of that crawl rather than of this run.
+        sync_started = read_from_json(crawl_state_file)['started']
+    else:
+        write_to_json({'started': sync_started}, crawl_state_file)
+
+    if args.resume and os.path.exists(labels_file):
+        assorted_items = read_from_json(labels_file)
+    else:
+        if args.incremental:
+            invalidate_query(queries['query_genre'])
+        genre_results = execute_query(endpoint_url, queries['query_genre'], query_type='query_genre')
+        genres = parse_genre_results(genre_results)
+
+        assorted_items = {}
+        for genre in genres:
+            if args.incremental:
+                invalidate_query(queries['query_items'].format(genre=genre))
+            try:
+                items = fetch_items_from_query(queries['query_items'], {'genre': genre}, query_type='query_items')
+                items = parse_item_results(items)
+                assorted_items.update(items)
+            except urllib.error.HTTPError as e:
+                print(f"HTTP Error fetching items for genre '{genre}': {e}")
+            except Exception as e:
+                print(f"Error fetching items for genre '{genre}': {e}")
+
+        write_to_json(assorted_items, labels_file)
+
+    if args.incremental:
+        retried = [item for item in previous_failed if item in assorted_items]
+        known_items = [item for item in assorted_items if item in previous_items and item not in retried]
+        modified = fetch_modified_items(queries['query_modified'], known_items, last_sync, max_workers=args.workers)
+        for item in modified:
+            invalidate_query(queries['query_details'].format(item=item))
+        upserted = retried + [item for item in assorted_items
+                              if item not in retried and (item in modified or item not in previous_items)]
+        deleted = [item for item in previous_items if item not in assorted_items]
+        print(f"Refreshing since {last_sync}: {len(upserted) - len(modified) - len(retried)} new, "
+              f"{len(modified)} modified, {len(retried)} previously failed and {len(deleted)} deleted items.")
+        previous_details = read_from_json(details_file)
+    else:
+        upserted, deleted = list(assorted_items), []
+
+    done = read_journal_items(journal_file) if args.resume else set()
+    pending = [item for item in upserted if item not in done]
+    if done:
+        print(f"Resuming crawl: {len(done)} items already journaled, {len(pending)} to go.")
+
+    if args.batch_size > 0:
+        fetched = fetch_details_batched(queries['query_details_batch'], pending, args.batch_size, args.workers,
+                                        item_query=queries['query_details'])
+    else:
+        fetched = fetch_details_concurrently(queries['query_details'], pending, args.workers)
+    failed = set()
+    with open_journal(journal_file, resume=args.resume) as journal:
+        for item, details, error in tqdm(fetched, total=len(pending)):
+            if isinstance(error, urllib.error.HTTPError):
+                print(f"HTTP Error fetching details for item '{item}': {error}")
+            elif error is not None:
+                print(f"Error fetching details for item '{item}': {error}")
+            else:
+                append_to_journal(journal, item, details[item])
+            if error is not None:
+                failed.add(item)
+
+    # Keep the original item order regardless of the order in which queries finished.
+    compact_journal(journal_file, details_file, item_order=list(assorted_items), base=previous_details)
+    if failed and not args.incremental:
+        # `--resume` skips the journaled items and fetches the failed ones again.
+        print(f"Keeping the journal, run with --resume to fetch the {len(failed)} failed items.")
+    else:
+        os.remove(journal_file)
+        os.remove(crawl_state_file)
+    # Failed items keep their previous details, if any, so they are not reported as changed; the
+    # sync state lists them for the next incremental run to refetch.
+    write_to_json({'since': last_sync if args.incremental else None, 'until': sync_started,
+                   'upserted': [item for item in upserted if item not in failed], 'deleted': deleted},
+                  changes_file)
+    write_to_json({'last_sync': sync_started, 'failed': [item for item in assorted_items if item in failed]},
+                  sync_state_file)
+    if failed:
+        print(f"Failed to fetch the details of {len(failed)} items, the next incremental run refetches them.")
+    if response_cache is not None:
+        print(f"Response cache: {response_cache.stats()}")
 
 
 if __name__ == "__main__":
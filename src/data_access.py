@@ -0,0 +1,538 @@
+import json
+import os
+import re
+import resource
+import sqlite3
+import sys
+import time
+import uuid
+import mysql.connector
+import mysql.connector.pooling
+import pandas as pd
+
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+from src.utils.cache import DiskCache, make_key
+from src.utils.utils import read_from_json, write_to_json
+
+# Enough connections for the widest loading stage of populate_db, plus the main thread
+POOL_SIZE = 5
+# Rows fetched from the server at a time when building DataFrames
+FETCH_SIZE = 10000
+# Path of the database of the SQLite backend, unless set with SQLITE_PATH in config/.env
+SQLITE_PATH = "data/metal_db.sqlite"
+
+# The errors raised by either backend
+DB_ERRORS = (mysql.connector.Error, sqlite3.Error)
+
+# Written by populate_db after every load. Cached query results are keyed by the version it
+# holds, so a new load invalidates them.
+DATASET_VERSION_FILE = "data/dataset_version.json"
+FRAME_CACHE_DIR = "data/cache/frames"
+FRAME_CACHE_SIZE_MB = 1024
+
+# The standard queries of the analysis notebooks, with the DataFrame columns of their results
+QUERIES = {
+    'albums': {
+        'sql': """
+            SELECT album.name, band.name, album.release_date, album.duration,
+            YEAR(band.start_date) AS start_year,
+            YEAR(band.end_date) AS end_year,
+            genre.genre_name AS genre
+            FROM album
+            INNER JOIN band ON album.band_id = band.id
+            INNER JOIN album_genre ON album.id = album_genre.album_id
+            INNER JOIN genre ON album_genre.genre_id = genre.id
+            """,
+        'columns': ['Album', 'Band', 'Release', 'Duration', 'Band Start', 'Band End', 'Genre'],
+    },
+    'bands': {
+        'sql': """
+            SELECT band.name, band.country, YEAR(band.start_date) - MOD(YEAR(band.start_date), 10) AS start_decade,
+            YEAR(band.start_date) AS start_year,
+            YEAR(band.end_date) AS end_year
+            FROM band
+            """,
+        'columns': ['Band', 'Country', 'Decade', 'Start', 'End'],
+    },
+    'band_genres': {
+        'sql': """
+            SELECT band.name, band.country, genre.genre_name, YEAR(band.start_date) - MOD(YEAR(band.start_date), 10) AS start_decade
+            FROM band
+            INNER JOIN band_genre ON band.id = band_genre.band_id
+            INNER JOIN genre ON band_genre.genre_id = genre.id
+            """,
+        'columns': ['Band', 'Country', 'Genre', 'Decade'],
+    },
+    'band_members': {
+        'sql': """
+            SELECT band.name, musician.name
+            FROM musician
+            INNER JOIN band_membership ON musician.id = band_membership.musician_id
+            INNER JOIN band ON band_membership.band_id = band.id
+            """,
+        'columns': ['Band', 'Musician'],
+    },
+    # The number of band memberships of musicians playing every instrument
+    'instrument_counts': {
+        'sql': """
+            SELECT musician_instrument.instrument, COUNT(*)
+            FROM musician_instrument
+            INNER JOIN band_membership ON musician_instrument.musician_id = band_membership.musician_id
+            INNER JOIN band ON band_membership.band_id = band.id
+            WHERE band.name <> ''
+            GROUP BY musician_instrument.instrument
+            """,
+        'columns': ['Instrument', 'Count'],
+    },
+    # The summary tables refreshed by populate_db
+    'band_stats': {
+        'sql': """
+            SELECT band.name, band_stats.album_count, band_stats.song_count, band_stats.member_count, band_stats.genre_count
+            FROM band_stats
+            INNER JOIN band ON band_stats.band_id = band.id
+            """,
+        'columns': ['Band', 'Number of Albums', 'Number of Songs', 'Number of Members', 'Number of Genres'],
+    },
+    'country_decade_counts': {
+        'sql': """
+            SELECT country, decade, band_count
+            FROM country_decade_stats
+            """,
+        'columns': ['Country', 'Decade', 'Bands'],
+    },
+    'genre_cooccurrence': {
+        'sql': """
+            SELECT genre.genre_name, other_genre.genre_name, genre_cooccurrence.band_count
+            FROM genre_cooccurrence
+            INNER JOIN genre ON genre_cooccurrence.genre_id = genre.id
+            INNER JOIN genre AS other_genre ON genre_cooccurrence.other_genre_id = other_genre.id
+            """,
+        'columns': ['Genre', 'Other Genre', 'Bands'],
+    },
+    'songs': {
+        'sql': """
+            SELECT song.name as song_name, band.name as band_name, genre.genre_name
+            FROM song
+            INNER JOIN band ON song.band_id=band.id
+            INNER JOIN band_genre ON band.id = band_genre.band_id
+            INNER JOIN genre ON band_genre.genre_id = genre.id
+            """,
+        'columns': ['Song', 'Band', 'Genre'],
+    },
+}
+
+
+class MySQLBackend:
+    """
+    The MySQL server configured in `config/.env`. The schema is created by `create_db.sql` and
+    kept up to date by the migrations of `src/sql/migrations`.
+    """
+
+    name = 'mysql'
+    placeholder = '%s'
+    schema_file = None
+    supports_bulk_load = True
+    supports_prepared = True
+
+    def database_id(self) -> str:
+        """Identifies the database the backend connects to."""
+        return f"{os.environ.get('DB_HOST')}/{os.environ.get('DB_NAME')}"
+
+    def create_pool(self, pool_size: int, allow_local_infile: bool):
+        return mysql.connector.pooling.MySQLConnectionPool(
+            pool_name="metal_db",
+            pool_size=pool_size,
+            host=os.environ.get("DB_HOST"),
+            user=os.environ.get("DB_USER"),
+            password=os.environ.get("DB_PASSWORD"),
+            database=os.environ.get("DB_NAME"),
+            allow_local_infile=allow_local_infile
+        )
+
+    def upsert_clause(self, columns: tuple, key_columns: tuple) -> str:
+        """
+        Builds the clause overwriting the given columns of the rows whose key already exists.
+
+        The clause names the inserted rows `new`, which follows either the `VALUES` list, as a
+        row alias, or the table of an `INSERT ... SELECT`, as a table alias.
+        """
+        return "AS new ON DUPLICATE KEY UPDATE " + ', '.join(f"{column} = new.{column}" for column in columns)
+
+    def auto_increment_step(self, cursor) -> int:
+        """Returns the increment between consecutive auto-incremented IDs."""
+        cursor.execute("SELECT @@auto_increment_increment")
+        return int(cursor.fetchall()[0][0])
+
+    def first_inserted_id(self, cursor, count: int):
+        """Returns the ID assigned to the first of the `count` rows of the last multi-row INSERT."""
+        return cursor.lastrowid or None
+
+    def set_foreign_key_checks(self, cursor, enabled: bool) -> None:
+        cursor.execute(f"SET foreign_key_checks = {int(enabled)}")
+
+
+def _sqlite_year(value):
+    """The MySQL `YEAR` function for dates stored as ISO strings."""
+    match = re.match(r'-?\d+', value) if isinstance(value, str) else None
+    return int(match.group()) if match else None
+
+
+def _sqlite_mod(dividend, divisor):
+    """The MySQL `MOD` function, which takes the sign of the dividend and is NULL for a zero divisor."""
+    if dividend is None or not divisor:
+        return None
+    remainder = abs(dividend) % abs(divisor)
+    return -remainder if dividend < 0 else remainder
+
+
+class SQLitePool:
+    """
+    Hands out connections to a SQLite database like a MySQL connection pool does, with the MySQL
+    functions used by `QUERIES` registered.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def get_connection(self):
+        # Loading stages write from several threads, each waiting for the others' transactions.
+        conn = sqlite3.connect(self.path, timeout=600, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.create_function('YEAR', 1, _sqlite_year, deterministic=True)
+        conn.create_function('MOD', 2, _sqlite_mod, deterministic=True)
+        return conn
+
+
+class SQLiteBackend:
+    """
+    An embedded SQLite database, which needs no server. The schema is created by
+    `create_db_sqlite.sql`, which is always at the latest version of the MySQL schema.
+    """
+
+    name = 'sqlite'
+    placeholder = '?'
+    schema_file = "src/sql/create_db_sqlite.sql"
+    supports_bulk_load = False
+    supports_prepared = False
+
+    def database_id(self) -> str:
+        """Identifies the database the backend connects to."""
+        return os.path.abspath(os.environ.get("SQLITE_PATH", SQLITE_PATH))
+
+    def create_pool(self, pool_size: int, allow_local_infile: bool):
+        return SQLitePool(os.environ.get("SQLITE_PATH", SQLITE_PATH))
+
+    def upsert_clause(self, columns: tuple, key_columns: tuple) -> str:
+        """Builds the clause overwriting the given columns of the rows whose key already exists."""
+        updated = [column for column in columns if column not in key_columns]
+        if not updated:
+            return f"ON CONFLICT ({', '.join(key_columns)}) DO NOTHING"
+        return (f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET "
+                + ', '.join(f"{column} = excluded.{column}" for column in updated))
+
+    def auto_increment_step(self, cursor) -> int:
+        """Returns the increment between consecutive auto-incremented IDs."""
+        return 1
+
+    def first_inserted_id(self, cursor, count: int):
+        """Returns the ID assigned to the first of the `count` rows of the last multi-row INSERT."""
+        return cursor.lastrowid - count + 1 if cursor.lastrowid else None
+
+    def set_foreign_key_checks(self, cursor, enabled: bool) -> None:
+        cursor.execute(f"PRAGMA foreign_keys = {'ON' if enabled else 'OFF'}")
+
+
+BACKENDS = {'mysql': MySQLBackend, 'sqlite': SQLiteBackend}
+
+
+class FrameCache(DiskCache):
+    """
+    Size-bounded, least-recently-used cache of query results, stored as Parquet files.
+    """
+
+    suffix = ".parquet"
+
+    def dump(self, value: pd.DataFrame, file_path: str) -> None:
+        value.to_parquet(file_path, index=False)
+
+    def load(self, file_path: str) -> pd.DataFrame:
+        return pd.read_parquet(file_path)
+
+
+_backend = None
+_pool = None
+_pool_local_infile = None
+_frame_cache = None
+
+
+def get_backend(name: str = None):
+    """
+    Returns the process-wide database backend, choosing it on first use.
+
+    Args:
+        name (str): `mysql` or `sqlite`. Defaults to the DB_BACKEND setting of `config/.env`,
+            or `mysql` if it is not set.
+
+    Returns:
+        The backend, see `MySQLBackend`.
+    """
+    global _backend
+    if _backend is None:
+        load_dotenv('config/.env')
+        _backend = BACKENDS[name or os.environ.get("DB_BACKEND", "mysql")]()
+    return _backend
+
+
+def get_pool(pool_size: int = POOL_SIZE, allow_local_infile: bool = None):
+    """
+    Returns the process-wide pool of connections to the database of the backend, creating it
+    on first use from the settings in `config/.env`.
+
+    Args:
+        pool_size (int): The number of connections of the pool, used when creating it.
+        allow_local_infile (bool): Whether to allow LOAD DATA LOCAL INFILE. Defaults to
+            whatever the pool allows, or to False when creating it.
+
+    Returns:
+        The connection pool, or None if the database could not be reached.
+
+    Raises:
+        ValueError: If the pool was already created with another `allow_local_infile`.
+    """
+    global _pool, _pool_local_infile
+    if _pool is not None and allow_local_infile is not None and allow_local_infile != _pool_local_infile:
+        raise ValueError(f"The connection pool was created with allow_local_infile={_pool_local_infile}")
+    if _pool is None:
+        try:
+            _pool = get_backend().create_pool(pool_size, bool(allow_local_infile))
+            _pool_local_infile = bool(allow_local_infile)
+        except DB_ERRORS as e:
+            print("Connection error:", e)
+    return _pool
+
+
+def get_connection():
+    """Returns a connection from the pool. Closing it hands it back to the pool."""
+    return get_pool().get_connection()
+
+
+def write_dataset_version() -> None:
+    """Records that the database was loaded again, invalidating the cached query results."""
+    os.makedirs(os.path.dirname(DATASET_VERSION_FILE), exist_ok=True)
+    write_to_json({"version": uuid.uuid4().hex, "loaded_at": datetime.now(timezone.utc).isoformat()},
+                  DATASET_VERSION_FILE)
+
+
+def get_frame_cache() -> FrameCache:
+    """Returns the process-wide cache of query results, creating it on first use."""
+    global _frame_cache
+    if _frame_cache is None:
+        _frame_cache = FrameCache(FRAME_CACHE_DIR, FRAME_CACHE_SIZE_MB * 2**20)
+    return _frame_cache
+
+
+def frame_cache_key(sql: str, params: tuple, columns: list) -> str:
+    """
+    Builds the cache key of a query result from the query, its parameters, the backend, the
+    database queried and the version of the loaded data.
+
+    Returns:
+        str: The key, or None if the version of the loaded data is unknown, in which case the
+            result is not cached.
+    """
+    if not os.path.exists(DATASET_VERSION_FILE):
+        return None
+    version = read_from_json(DATASET_VERSION_FILE)["version"]
+    backend = get_backend()
+    return make_key(backend.name, backend.database_id(), version, sql, json.dumps(params, default=str),
+                    json.dumps(columns))
+
+
+def peak_memory_mb() -> float:
+    """Returns the peak resident memory of the process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def fetch_row_chunks(sql: str, params: tuple = None, chunk_size: int = FETCH_SIZE, prepared: bool = False):
+    """
+    Runs a query and yields its rows `chunk_size` at a time, fetched from an unbuffered cursor,
+    so that only one chunk of the result is in memory at a time. Queries with parameters run as
+    prepared statements on MySQL.
+
+    Args:
+        sql (str): The query, with `%s` placeholders for the parameters.
+        params (tuple): The parameters of the query.
+        chunk_size (int): The number of rows of every chunk.
+        prepared (bool): Whether to run the query as a prepared statement on MySQL even if it
+            has no parameters, so that its rows come back in the binary protocol.
+
+    Yields:
+        tuple: The names of the result columns and a list of up to `chunk_size` row tuples.
+            An empty result yields its column names with no rows.
+    """
+    backend = get_backend()
+    conn = get_connection()
+    if (params or prepared) and backend.supports_prepared:
+        cursor = conn.cursor(prepared=True)
+    elif backend.name == 'mysql':
+        cursor = conn.cursor(buffered=False)
+    else:
+        cursor = conn.cursor()
+    try:
+        cursor.execute(sql.replace('%s', backend.placeholder), params or ())
+        names = [description[0] for description in cursor.description]
+        rows = cursor.fetchmany(chunk_size)
+        yield names, rows
+        while rows:
+            rows = cursor.fetchmany(chunk_size)
+            if rows:
+                yield names, rows
+    finally:
+        # Rows left unread by an abandoned stream must be consumed before the connection is reused.
+        consume_results = getattr(conn, 'consume_results', None)
+        if consume_results is not None:
+            consume_results()
+        cursor.close()
+        conn.close()
+
+
+def stream_query(sql: str, params: tuple = None, columns: list = None, chunk_size: int = FETCH_SIZE,
+                 report: bool = False):
+    """
+    Runs a query and yields its result in DataFrame chunks, see `fetch_row_chunks`.
+
+    The types of the columns are inferred for every chunk on its own, so a column may have
+    different types in different chunks, e.g. `object` in a chunk where an integer column is
+    all NULL. Use `query_df` for a DataFrame of the whole result.
+
+    Args:
+        sql (str): The query, with `%s` placeholders for the parameters.
+        params (tuple): The parameters of the query.
+        columns (list): The names of the DataFrame columns. Defaults to the names of the
+            result columns.
+        chunk_size (int): The number of rows of every chunk.
+        report (bool): Whether to print the rows per second and peak memory once the result
+            is exhausted.
+
+    Yields:
+        pd.DataFrame: The chunks of the result, with typed columns. An empty result yields a
+            single empty chunk.
+    """
+    start = time.perf_counter()
+    streamed = 0
+    for names, rows in fetch_row_chunks(sql, params, chunk_size):
+        if not rows:
+            yield pd.DataFrame(columns=columns or names)
+            continue
+        chunk = pd.DataFrame.from_records(rows)
+        # Set afterwards, since several result columns may share a name.
+        chunk.columns = columns or names
+        streamed += len(rows)
+        yield chunk
+    if report:
+        elapsed = time.perf_counter() - start
+        rate = streamed / elapsed if elapsed else 0
+        print(f"Streamed {streamed} rows in {elapsed:.2f}s ({rate:.0f} rows/s), "
+              f"peak memory {peak_memory_mb():.0f} MB")
+
+
+def reduce_query(sql: str, reducer, initial=None, params: tuple = None, columns: list = None,
+                 chunk_size: int = FETCH_SIZE):
+    """
+    Folds the result of a query chunk by chunk, without holding it in memory as a whole, and
+    reports the rows per second and peak memory.
+
+    Usage:
+        counts = reduce_query(QUERIES['songs']['sql'],
+                              lambda counts, chunk: counts.add(chunk['genre_name'].value_counts(), fill_value=0),
+                              pd.Series(dtype=float))
+
+    Args:
+        sql (str): The query, with `%s` placeholders for the parameters.
+        reducer (callable): Called with the result so far and the next DataFrame chunk,
+            returns the new result.
+        initial: The result before the first chunk.
+        params (tuple): The parameters of the query.
+        columns (list): The names of the DataFrame columns, see `stream_query`.
+        chunk_size (int): The number of rows of every chunk.
+
+    Returns:
+        The result of the last call to `reducer`.
+    """
+    result = initial
+    for chunk in stream_query(sql, params, columns, chunk_size, report=True):
+        result = reducer(result, chunk)
+    return result
+
+
+def query_df(sql: str, params: tuple = None, columns: list = None, use_cache: bool = False,
+             prepared: bool = False) -> pd.DataFrame:
+    """
+    Runs a query and builds a DataFrame from its result.
+
+    Rows are fetched in chunks by `fetch_row_chunks` and appended column by column, so the result
+    is never held as a list of row tuples. The type of every column is inferred once, from all its
+    values, and the values of each column are released as soon as it is converted.
+
+    Args:
+        sql (str): The query, with `%s` placeholders for the parameters.
+        params (tuple): The parameters of the query.
+        columns (list): The names of the DataFrame columns. Defaults to the names of the
+            result columns.
+        use_cache (bool): Whether to look the result up in, and store it in, the cache of
+            query results, see `FrameCache`.
+        prepared (bool): Whether to run the query as a prepared statement, see
+            `fetch_row_chunks`.
+
+    Returns:
+        pd.DataFrame: The result of the query.
+    """
+    key = frame_cache_key(sql, params, columns) if use_cache else None
+    if key is not None:
+        frame = get_frame_cache().get(key)
+        if frame is not None:
+            return frame
+
+    values = None
+    for names, rows in fetch_row_chunks(sql, params, prepared=prepared):
+        if values is None:
+            values = [[] for _ in names]
+            columns = columns or names
+        for column_values, chunk in zip(values, zip(*rows)):
+            column_values.extend(chunk)
+    typed = {}
+    for position in range(len(values)):
+        typed[position] = pd.Series(values[position])
+        values[position] = None
+    # Build from positions, since several result columns may share a name.
+    frame = pd.DataFrame(typed)
+    frame.columns = columns
+    if key is not None:
+        try:
+            get_frame_cache().put(key, frame)
+        except (ValueError, TypeError) as e:
+            # Parquet needs unique column names and a single type per column.
+            print(f"Query result not cached: {e}")
+    return frame
+
+
+def run_query(name: str, params: tuple = None, use_cache: bool = True) -> pd.DataFrame:
+    """
+    Runs one of the standard queries of `QUERIES` as a prepared statement, reusing its cached
+    result if the database was not loaded again since.
+
+    Args:
+        name (str): The name of the query.
+        params (tuple): The parameters of the query, if it has any.
+        use_cache (bool): Whether to use the cache of query results.
+
+    Returns:
+        pd.DataFrame: The result of the query, with the columns listed in `QUERIES`.
+    """
+    query = QUERIES[name]
+    return query_df(query['sql'], params, query['columns'], use_cache, prepared=True)
@@ -1,41 +1,146 @@
+import argparse
 import os
-import mysql.connector
-
-from dotenv import load_dotenv
-
+import re
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+from src.data.extract_details import DetailsIndex
+from src.data.item_store import load_formatted_items
+from src.data.process_frames import (
+    process_musician_frame,
+    process_musician_instruments_frame,
+    process_band_frame,
+    process_album_frame,
+    process_song_frame)
 from src.data.process_data import (
-    format_items,
+    format_items_parallel,
+    index_item_types,
     process_genre, 
     process_musician, 
+    process_musician_instruments,
     process_band, 
     process_album, 
     process_song,
     process_junction_data)
+from src.data_access import BACKENDS, DB_ERRORS, get_backend, get_pool, write_dataset_version
 from src.utils.utils import read_from_json
 
+CHANGES_FILE = "data/raw/changes.json"
+MIGRATIONS_DIR = "src/sql/migrations"
 
-def connect_to_database():
-    """Connect to the MySQL database."""
-    load_dotenv('config/.env')
-    
-    try:
-        conn = mysql.connector.connect(
-            host=os.environ.get("DB_HOST"),
-            user=os.environ.get("DB_USER"),
-            password=os.environ.get("DB_PASSWORD"),
-            database=os.environ.get("DB_NAME")
-        )        
-        return conn
-    
-    except mysql.connector.Error as e:
-        print("Connection error:", e)
-        return None
+# Rows are inserted, and wikidata_ids looked up, this many at a time to stay within
+# the server's packet and placeholder limits.
+INSERT_CHUNK_SIZE = 1000
+LOOKUP_CHUNK_SIZE = 1000
+
+# Errors raised by LOAD DATA LOCAL INFILE when local infile is disabled on the server or
+# the client, in which case the rows are inserted with INSERT statements instead.
+LOCAL_INFILE_ERRORS = (1148, 2068, 3948)
+
+# Bands without an end date are counted as active until this year, as in the notebooks.
+ACTIVE_UNTIL_YEAR = 2024
+
+# Columns referencing each table, so that deleted rows can be detached first. Junction table
+# rows are deleted along with the row they reference, other references are set to NULL.
+REFERENCES = {
+    'band': [('band_membership', 'band_id'), ('band_genre', 'band_id'), ('album', 'band_id'), ('song', 'band_id')],
+    'musician': [('band_membership', 'musician_id'), ('musician_instrument', 'musician_id')],
+    'genre': [('band_genre', 'genre_id'), ('album_genre', 'genre_id')],
+    'album': [('album_genre', 'album_id'), ('song', 'album_id')],
+    'song': [],
+}
+JUNCTION_TABLES = ('band_membership', 'band_genre', 'album_genre', 'musician_instrument')
+
+# Functions preparing the rows of the entity tables, per transform engine. Both engines
+# produce the same rows, the `dataframe` one with vectorized DataFrame operations.
+TRANSFORM_ENGINES = {
+    'python': {'musician': process_musician, 'musician_instrument': process_musician_instruments,
+               'band': process_band, 'album': process_album, 'song': process_song},
+    'dataframe': {'musician': process_musician_frame, 'musician_instrument': process_musician_instruments_frame,
+                  'band': process_band_frame, 'album': process_album_frame, 'song': process_song_frame},
+}
+
+
+def read_sql_statements(file_path: str) -> list[str]:
+    """Splits a SQL script into its statements, leaving out `--` comments."""
+    return [statement for step in read_sql_steps(file_path) for statement in step]
+
+
+def read_sql_steps(file_path: str) -> list[list[str]]:
+    """
+    Splits a SQL script into steps, the groups of statements separated by blank lines, and every
+    step into its statements, leaving out `--` comments.
+    """
+    with open(file_path, 'r', encoding='utf-8') as sql_file:
+        lines = [line for line in sql_file if not line.lstrip().startswith('--')]
+    steps = []
+    for block in re.split(r'\n\s*\n', ''.join(lines)):
+        statements = [statement.strip() for statement in block.split(';') if statement.strip()]
+        if statements:
+            steps.append(statements)
+    return steps
+
+
+def migrate(cursor, migrations_dir: str = MIGRATIONS_DIR) -> None:
+    """
+    Brings the schema up to date by running the migrations that were not applied yet.
+
+    Migrations are the SQL scripts of `migrations_dir` named after their version, such as
+    `001_wikidata_id_indexes.sql`. They run in version order, and every applied version is
+    recorded in the `schema_version` table.
+
+    MySQL commits DDL statements implicitly, so a migration that fails halfway cannot be rolled
+    back. Instead, the steps of a migration, its groups of statements separated by blank lines,
+    are committed one at a time, and the number of steps done is recorded in the
+    `schema_migration_progress` table, so that running the migration again resumes it after the
+    last completed step. A step holds at most one DDL statement, or statements sharing
+    temporary tables, which only live as long as the connection.
+
+    Args:
+        cursor: The MySQL cursor object.
+        migrations_dir (str): The directory of the migration scripts.
+    """
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version "
+                   "(version INT PRIMARY KEY, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_migration_progress "
+                   "(version INT PRIMARY KEY, steps INT NOT NULL)")
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    current_version = cursor.fetchall()[0][0]
+
+    migrations = sorted((int(name.split('_', 1)[0]), name) for name in os.listdir(migrations_dir)
+                        if name.endswith('.sql'))
+    for version, name in migrations:
+        if version <= current_version:
+            continue
+        cursor.execute("SELECT steps FROM schema_migration_progress WHERE version = %s", (version,))
+        progress = cursor.fetchall()
+        done = progress[0][0] if progress else 0
+        if done:
+            print(f"Resuming migration {name} after step {done}")
+        steps = read_sql_steps(os.path.join(migrations_dir, name))
+        for step_number, step in enumerate(steps[done:], done + 1):
+            for statement in step:
+                cursor.execute(statement)
+            cursor.execute("REPLACE INTO schema_migration_progress (version, steps) VALUES (%s, %s)",
+                           (version, step_number))
+            cursor.execute("COMMIT")
+        cursor.execute("INSERT INTO schema_version (version) VALUES (%s)", (version,))
+        cursor.execute("DELETE FROM schema_migration_progress WHERE version = %s", (version,))
+        cursor.execute("COMMIT")
+        print(f"Applied migration {name}")
 
 
 def fetch_referenced_ids(cursor, table: str, identifiers: list) -> dict:
     """
     Fetch the auto-incremented ids from the referenced table based on a condition.
 
+    The identifiers are looked up `LOOKUP_CHUNK_SIZE` at a time.
+
     Args:
         cursor: The MySQL cursor object.
         table: The name of the table to fetch the foreign keys from.
@@ -45,15 +150,76 @@ def fetch_referenced_ids(cursor, table: str, identifiers: list) -> dict:
         A dictionary of IDs retrieved from the referenced table in the format
         {wikidata_id: id}.
     """
+    referenced_ids = {}
+    for start in range(0, len(identifiers), LOOKUP_CHUNK_SIZE):
+        chunk = identifiers[start:start + LOOKUP_CHUNK_SIZE]
+        placeholders = ', '.join([get_backend().placeholder] * len(chunk))
+        sql = f"SELECT wikidata_id, id FROM {table} WHERE wikidata_id IN ({placeholders})"
+        cursor.execute(sql, tuple(chunk))
+        referenced_ids.update({result[0]: str(result[1]) for result in cursor.fetchall()})
+    return referenced_ids
 
 
-    sql = f"SELECT wikidata_id, id FROM {table} WHERE wikidata_id IN ({', '.join(['%s'] * len(identifiers))})"
-    cursor.execute(sql, tuple(identifiers))
-    results = cursor.fetchall()
-    return {result[0]: str(result[1]) for result in results}
+class IdMap:
+    """
+    In-process map from wikidata_id to auto-incremented id for each table, shared by all the
+    loading stages.
 
+    IDs assigned by `batch_insert` are recorded as rows are inserted, so that resolving foreign
+    keys only queries the database for the wikidata_ids that were not inserted by this process.
+    The tables of a stage are loaded by concurrent threads, so the maps are only changed under
+    a lock.
+    """
 
-def replace_foreign_keys(cursor, table: str, idx: int, data: list[tuple]) -> list[tuple]:
+    def __init__(self):
+        self.maps = {}
+        self.lock = threading.Lock()
+
+    def record(self, table: str, wikidata_ids: list, ids: list) -> None:
+        """
+        Records the IDs assigned to rows of a table.
+
+        Args:
+            table (str): The name of the table.
+            wikidata_ids (list): The wikidata_ids of the rows.
+            ids (list): The IDs of the rows, in the same order. None where unknown.
+        """
+        with self.lock:
+            table_map = self.maps.setdefault(table, {})
+            table_map.update((wikidata_id, row_id) for wikidata_id, row_id in zip(wikidata_ids, ids)
+                             if row_id is not None)
+
+    def forget(self, table: str, wikidata_ids: list) -> None:
+        """Removes deleted rows from the map of a table."""
+        with self.lock:
+            table_map = self.maps.get(table, {})
+            for wikidata_id in wikidata_ids:
+                table_map.pop(wikidata_id, None)
+
+    def resolve(self, cursor, table: str, identifiers: list) -> dict:
+        """
+        Resolves wikidata_ids to the IDs of a table, querying the database for unknown ones.
+
+        Args:
+            cursor: The MySQL cursor object.
+            table (str): The name of the table.
+            identifiers (list): The wikidata_ids to resolve.
+
+        Returns:
+            dict: The map of the table in the format {wikidata_id: id}, which covers every
+                identifier found in the table.
+        """
+        with self.lock:
+            table_map = self.maps.setdefault(table, {})
+            missing = list({identifier for identifier in identifiers
+                            if identifier is not None and identifier not in table_map})
+        found = fetch_referenced_ids(cursor, table, missing)
+        with self.lock:
+            table_map.update(found)
+        return table_map
+
+
+def replace_foreign_keys(cursor, table: str, idx: int, data: list[tuple], id_map: IdMap = None) -> list[tuple]:
     """
     Replace wikidata_ids as foreign keys to the data based on the referenced table's IDs.
 
@@ -62,17 +228,21 @@ def replace_foreign_keys(cursor, table: str, idx: int, data: list[tuple]) -> lis
         table: The name of the table to fetch the foreign keys from.
         idx: The column index to fetch the foreign keys for.
         data: The data to add the foreign keys to.
+        id_map: The IDs known so far, queried from the database if not given.
 
     Returns:
         The data with the correct foreign keys replacing the wikidata_ids.
     """
-
-    foreign_keys = fetch_referenced_ids(cursor, table, [row[idx] for row in data])
+    identifiers = [row[idx] for row in data]
+    if id_map is None:
+        foreign_keys = fetch_referenced_ids(cursor, table, list({i for i in identifiers if i is not None}))
+    else:
+        foreign_keys = id_map.resolve(cursor, table, identifiers)
     data = [tuple((list(row)[:idx] + [foreign_keys.get(row[idx], None)] + list(row)[idx+1:])) for row in data]
     return data
 
 
-def replace_junction_table_fk(cursor, tables: tuple, data: list[tuple]) -> list[tuple]:
+def replace_junction_table_fk(cursor, tables: tuple, data: list[tuple], id_map: IdMap = None) -> list[tuple]:
     """
     Prepares junction table data with correct foreign keys.
 
@@ -80,13 +250,15 @@ def replace_junction_table_fk(cursor, tables: tuple, data: list[tuple]) -> list[
         cursor: The MySQL cursor object.
         tables (list): A list containing the names of the two tables referenced by the junction table.
         data (list): A list of tuples representing the original data with `wikidata_id` values.
+        id_map (IdMap): The IDs known so far, queried from the database if not given.
 
     Returns:
         list: A list of tuples representing the prepared junction table data with correct foreign keys.
     """
-
-    foreign_keys1 = fetch_referenced_ids(cursor, tables[0], [row[0] for row in data])
-    foreign_keys2 = fetch_referenced_ids(cursor, tables[1], [row[1] for row in data])
+    if id_map is None:
+        id_map = IdMap()
+    foreign_keys1 = id_map.resolve(cursor, tables[0], [row[0] for row in data])
+    foreign_keys2 = id_map.resolve(cursor, tables[1], [row[1] for row in data])
     try:
         junction_data = [(foreign_keys1[row[0]], foreign_keys2[row[1]]) for row in data if row[0] in foreign_keys1 and row[1] in foreign_keys2]
         junction_data = [row for row in junction_data if None not in row]
@@ -95,93 +267,627 @@ def replace_junction_table_fk(cursor, tables: tuple, data: list[tuple]) -> list[
     except KeyError as e:
         print('Error:', e)
 
-    
 
+def escape_tsv_value(value) -> str:
+    """
+    Formats a value for the default format of LOAD DATA: NULL as `\\N`, and backslashes, tabs,
+    newlines, carriage returns and NUL characters escaped with a backslash.
+    """
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+            .replace('\r', '\\r').replace('\0', '\\0'))
+
+
+def conflict_key(columns: tuple) -> tuple:
+    """Returns the unique key of the rows of a table: the wikidata_id of entities, all the columns of junction tables."""
+    return ('wikidata_id',) if 'wikidata_id' in columns else columns
+
+
+def load_data_infile(cursor, table: str, columns: tuple, data: list[tuple]) -> int:
+    """
+    Bulk loads data into the specified table by streaming it to a temporary TSV file loaded
+    with LOAD DATA LOCAL INFILE.
+
+    The file is loaded into a temporary staging table, copied into the table with
+    `INSERT ... SELECT ... ON DUPLICATE KEY UPDATE`, so that rows that already exist are updated.
+
+    Args:
+        cursor: The MySQL cursor object, of a connection allowing local infile.
+        table (str): The name of the table to load data into.
+        columns (list): A list of column names in the same order as the data.
+        data (list of tuples): A list of tuples representing the data to be loaded.
+
+    Returns:
+        int: The number of rows loaded.
 
-def batch_insert(cursor, table: str, columns: tuple, data: list[tuple]):
+    Raises:
+        mysql.connector.Error: If the rows could not be loaded.
     """
-    Batch inserts data into the specified table.
+    column_names = ', '.join(columns)
+    staging_table = f"{table}_staging"
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='\n', suffix='.tsv', delete=False) as tsv_file:
+        for row in data:
+            tsv_file.write('\t'.join(escape_tsv_value(value) for value in row) + '\n')
+    try:
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {staging_table}")
+        cursor.execute(f"CREATE TEMPORARY TABLE {staging_table} LIKE {table}")
+        cursor.execute(f"LOAD DATA LOCAL INFILE %s INTO TABLE {staging_table} CHARACTER SET utf8mb4 "
+                       f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+                       f"({column_names})", (tsv_file.name,))
+        loaded = cursor.rowcount
+        cursor.execute(f"INSERT INTO {table} ({column_names}) SELECT {column_names} FROM {staging_table} "
+                       f"{get_backend().upsert_clause(columns, conflict_key(columns))}")
+        cursor.execute(f"DROP TEMPORARY TABLE {staging_table}")
+        return loaded
+    finally:
+        os.remove(tsv_file.name)
+
+
+def insert_chunks(cursor, table: str, columns: tuple, data: list[tuple]) -> tuple[list, int, int]:
+    """
+    Inserts data into the specified table with one multi-row `INSERT ... ON DUPLICATE KEY UPDATE`
+    per `INSERT_CHUNK_SIZE` rows.
+
+    A multi-row `INSERT` of new rows is assigned consecutive auto-incremented IDs starting at
+    `lastrowid`, which is how the IDs of the inserted rows are derived without querying them
+    back. The derived IDs are only meaningful if none of the rows already exists.
+
+    Returns:
+        tuple: The IDs assigned to the rows, see `batch_insert`, the number of rows written and
+            the number of chunks that could not be inserted.
+    """
+    backend = get_backend()
+    column_names = ', '.join(columns)
+    placeholders = '(' + ', '.join([backend.placeholder] * len(columns)) + ')'
+    ids = []
+    written = 0
+    failed_chunks = 0
+    step = backend.auto_increment_step(cursor)
+    for start in range(0, len(data), INSERT_CHUNK_SIZE):
+        chunk = data[start:start + INSERT_CHUNK_SIZE]
+        try:
+            sql = (f"INSERT INTO {table} ({column_names}) VALUES {', '.join([placeholders] * len(chunk))} "
+                   f"{backend.upsert_clause(columns, conflict_key(columns))}")
+            cursor.execute(sql, [value for row in chunk for value in row])
+        except DB_ERRORS as err:
+            print(f"Insertion error: {err}")
+            ids.extend([None] * len(chunk))
+            failed_chunks += 1
+            continue
+        written += len(chunk)
+        first_id = backend.first_inserted_id(cursor, len(chunk))
+        ids.extend(str(first_id + i * step) if first_id else None for i in range(len(chunk)))
+    return ids, written, failed_chunks
+
+
+def batch_insert(cursor, table: str, columns: tuple, data: list[tuple], bulk: bool = False) -> list:
+    """
+    Batch inserts data into the specified table, updating the rows whose primary or unique
+    key already exists, so that loading the same data again leaves the table unchanged.
+
+    Rows are written with chunked multi-row `INSERT` statements, or, in bulk mode, loaded with
+    LOAD DATA LOCAL INFILE, falling back to `INSERT` statements when local infile is disabled.
 
     Args:
         cursor: The MySQL cursor object.
         table (str): The name of the table to insert data into.
         columns (list): A list of column names in the same order as the data.
         data (list of tuples): A list of tuples representing the data to be inserted.
-    """
+        bulk (bool): Whether to load the rows with LOAD DATA LOCAL INFILE.
 
-    column_names = ', '.join(columns)
-    placeholders = ', '.join(['%s'] * len(columns))
+    Returns:
+        list: The IDs assigned to the rows, in the same order as the data, as strings, if none
+            of them already existed. None for all rows of tables without auto-increment, and for
+            all rows loaded in bulk mode, whose IDs are not reported by the server.
+
+    Raises:
+        RuntimeError: If some chunks could not be inserted, once the other chunks are written,
+            so that the load of the table fails as a whole.
+    """
     try:
-        sql = f"INSERT INTO {table} ({column_names}) VALUES ({placeholders})"
         cursor.fetchall()
-        cursor.executemany(sql, data)
-        print(f"Successfully inserted {cursor.rowcount} rows into {table}")
-    except mysql.connector.Error as err:
-        print(f"Insertion error: {err}")
+    except DB_ERRORS:
+        pass
+    start = time.perf_counter()
+    ids = None
+    failed_chunks = 0
+    if bulk and get_backend().supports_bulk_load:
+        try:
+            written = load_data_infile(cursor, table, columns, data)
+            ids = [None] * len(data)
+        except DB_ERRORS as err:
+            if err.errno not in LOCAL_INFILE_ERRORS:
+                raise
+            print(f"Local infile is disabled, inserting the rows of {table} with INSERT statements")
+    if ids is None:
+        ids, written, failed_chunks = insert_chunks(cursor, table, columns, data)
+    elapsed = time.perf_counter() - start
+    rate = written / elapsed if elapsed else 0
+    if failed_chunks:
+        raise RuntimeError(f"Wrote {written} rows into {table} in {elapsed:.2f}s, but "
+                           f"{failed_chunks} chunks ({len(data) - written} rows) failed")
+    print(f"Successfully wrote {written} rows into {table} in {elapsed:.2f}s ({rate:.0f} rows/s)")
+    return ids
+
+
+def is_empty(cursor, table: str) -> bool:
+    """Tells whether a table has no rows."""
+    cursor.execute(f"SELECT 1 FROM {table} LIMIT 1")
+    return not cursor.fetchall()
+
+
+def upsert_rows(cursor, table: str, columns: tuple, data: list[tuple], id_map: IdMap,
+                key_column: str = 'wikidata_id', bulk: bool = False) -> list:
+    """
+    Writes the rows of an entity table, updating the rows whose key already exists.
+
+    Rows with the same key are collapsed onto the last one. Rows whose key is already in the
+    table are written apart from the new rows, so that the IDs of the new rows can be derived
+    by `batch_insert`. Looking the keys up is skipped when the table is empty, as on a first
+    load, since all the rows are new then.
+
+    Args:
+        cursor: The MySQL cursor object.
+        table (str): The name of the table to upsert data into.
+        columns (list): A list of column names in the same order as the data.
+        data (list of tuples): A list of tuples representing the data to be upserted.
+        id_map (IdMap): The IDs known so far.
+        key_column (str): The column identifying each row.
+        bulk (bool): Whether to load the rows with LOAD DATA LOCAL INFILE.
+
+    Returns:
+        list: The IDs of the rows, in the same order as the data, see `batch_insert`.
+    """
+    key_idx = columns.index(key_column)
+    rows = {row[key_idx]: row for row in data}
+    existing_ids = {} if is_empty(cursor, table) else id_map.resolve(cursor, table, list(rows))
+    existing_rows = [row for key, row in rows.items() if key in existing_ids]
+    new_rows = [row for key, row in rows.items() if key not in existing_ids]
+
+    ids = {key: existing_ids[key] for key in rows if key in existing_ids}
+    if existing_rows:
+        batch_insert(cursor, table, columns, existing_rows, bulk)
+    if new_rows:
+        new_ids = batch_insert(cursor, table, columns, new_rows, bulk)
+        ids.update(zip((row[key_idx] for row in new_rows), new_ids))
+    return [ids.get(row[key_idx]) for row in data]
+
+
+def write_entities(cursor, table: str, columns: tuple, data: list[tuple], id_map: IdMap,
+                   bulk: bool = False, foreign_keys: tuple = ()) -> None:
+    """
+    Upserts the rows of an entity table and records the IDs they are assigned in the ID map.
+    The IDs of rows loaded in bulk mode are not known, and are looked up when resolving
+    foreign keys instead.
+
+    Args:
+        cursor: The MySQL cursor object.
+        table (str): The name of the entity table.
+        columns (list): A list of column names in the same order as the data, including `wikidata_id`.
+        data (list of tuples): A list of tuples representing the rows.
+        id_map (IdMap): The ID map to record the IDs in.
+        bulk (bool): Whether to load the rows with LOAD DATA LOCAL INFILE.
+        foreign_keys (tuple): The `(referenced_table, column_index)` pairs of the columns whose
+            wikidata_ids are replaced with the IDs of the referenced table before writing.
+    """
+    for referenced_table, idx in foreign_keys:
+        data = replace_foreign_keys(cursor, referenced_table, idx, data, id_map)
+    ids = upsert_rows(cursor, table, columns, data, id_map, bulk=bulk)
+    key_idx = columns.index('wikidata_id')
+    id_map.record(table, [row[key_idx] for row in data], ids)
+
+
+def write_junction_rows(cursor, table: str, columns: tuple, referenced_tables: tuple, data: list[tuple],
+                        id_map: IdMap, bulk: bool = False) -> None:
+    """
+    Replaces the wikidata_ids of junction table rows with the IDs of the referenced tables and
+    writes them. A referenced table of None leaves the values of its column as they are, such
+    as the instrument names of `musician_instrument`.
+
+    Args:
+        cursor: The MySQL cursor object.
+        table (str): The name of the junction table.
+        columns (list): The two foreign key columns.
+        referenced_tables (tuple): The names of the tables the columns reference.
+        data (list of tuples): The rows, with wikidata_ids.
+        id_map (IdMap): The IDs known so far.
+        bulk (bool): Whether to load the rows with LOAD DATA LOCAL INFILE.
+    """
+    if referenced_tables[1] is None:
+        data = replace_foreign_keys(cursor, referenced_tables[0], 0, data, id_map)
+        data = list({row for row in data if row[0] is not None})
+    else:
+        data = replace_junction_table_fk(cursor, referenced_tables, data, id_map)
+    batch_insert(cursor, table, columns, data, bulk)
+
+
+def run_load_task(pool, load) -> float:
+    """
+    Runs a loading task on a pooled connection with foreign key checks disabled, and commits it.
+    A task that fails is rolled back.
+
+    Args:
+        pool: The connection pool.
+        load (callable): The task, called with a cursor.
+
+    Returns:
+        float: The time the task took, in seconds.
+    """
+    conn = pool.get_connection()
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    try:
+        get_backend().set_foreign_key_checks(cursor, False)
+        load(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        get_backend().set_foreign_key_checks(cursor, True)
+        cursor.close()
+        conn.close()
+    return time.perf_counter() - start
+
+
+def load_stages(pool, stages: list[dict]) -> tuple[dict, dict]:
+    """
+    Runs the loading stages in order. The tables of a stage do not depend on each other, and
+    are loaded concurrently on connections of the pool.
+
+    Every table is committed on its own, so the load is not atomic: when a table fails to load,
+    the tables loaded so far stay committed and the later stages are skipped. Since loading
+    updates existing rows, running the load again completes it.
+
+    Args:
+        pool: The connection pool.
+        stages (list): The stages, each a dictionary mapping a table to the task loading it,
+            see `run_load_task`.
+
+    Returns:
+        tuple: The time each loaded table took, in seconds, by table, and the error raised by
+            each table that failed to load, by table.
+    """
+    timings = {}
+    errors = {}
+    for stage in stages:
+        with ThreadPoolExecutor(max_workers=len(stage)) as executor:
+            futures = {executor.submit(run_load_task, pool, load): table for table, load in stage.items()}
+            for future in as_completed(futures):
+                table = futures[future]
+                try:
+                    timings[table] = future.result()
+                except Exception as e:
+                    print(f"Error loading {table}: {e}")
+                    errors[table] = e
+        if errors:
+            print("Skipping the remaining loading stages.")
+            break
+    return timings, errors
+
+
+def find_orphans(cursor) -> dict:
+    """
+    Checks the referential integrity of the loaded tables with a single query, since the tables
+    are loaded with foreign key checks disabled.
+
+    Args:
+        cursor: The MySQL cursor object.
+
+    Returns:
+        dict: The number of values referencing a missing row, for every foreign key column
+            that has any, in the format {'table.column': count}.
+    """
+    checks = [f"SELECT '{referencing_table}.{column}', COUNT(*) FROM {referencing_table} r "
+              f"LEFT JOIN {table} t ON r.{column} = t.id WHERE r.{column} IS NOT NULL AND t.id IS NULL"
+              for table, references in REFERENCES.items() for referencing_table, column in references]
+    cursor.execute(' UNION ALL '.join(checks))
+    return {reference: count for reference, count in cursor.fetchall() if count}
+
+
+def delete_entities(cursor, wikidata_ids: list, id_map: IdMap) -> None:
+    """
+    Deletes the rows of the entity tables with the given wikidata_ids, together with the
+    junction table rows referencing them. Other references to them are set to NULL.
+
+    Args:
+        cursor: The MySQL cursor object.
+        wikidata_ids (list): The wikidata_ids of the entities to delete.
+        id_map (IdMap): The IDs known so far, from which the deleted rows are removed.
+    """
+    for table, references in REFERENCES.items():
+        table_map = id_map.resolve(cursor, table, wikidata_ids)
+        ids = [table_map[wikidata_id] for wikidata_id in wikidata_ids if wikidata_id in table_map]
+        if not ids:
+            continue
+        deleted = 0
+        for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+            chunk = ids[start:start + LOOKUP_CHUNK_SIZE]
+            placeholders = ', '.join([get_backend().placeholder] * len(chunk))
+            for referencing_table, column in references:
+                if referencing_table in JUNCTION_TABLES:
+                    cursor.execute(f"DELETE FROM {referencing_table} WHERE {column} IN ({placeholders})", chunk)
+                else:
+                    cursor.execute(f"UPDATE {referencing_table} SET {column} = NULL WHERE {column} IN ({placeholders})", chunk)
+            cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", chunk)
+            deleted += cursor.rowcount
+        id_map.forget(table, wikidata_ids)
+        print(f"Successfully deleted {deleted} rows from {table}")
+
+
+def delete_junction_rows(cursor, table: str, column: str, ids: list) -> None:
+    """
+    Deletes the rows of a junction table that reference any of the given IDs.
 
+    Args:
+        cursor: The MySQL cursor object.
+        table (str): The name of the junction table.
+        column (str): The foreign key column to match.
+        ids (list): The IDs whose rows are deleted.
+    """
+    for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+        chunk = ids[start:start + LOOKUP_CHUNK_SIZE]
+        placeholders = ', '.join([get_backend().placeholder] * len(chunk))
+        cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({placeholders})", chunk)
+
+
+def affected_band_ids(cursor, wikidata_ids: list) -> set:
+    """
+    Finds the bands whose summary depends on the given entities: the bands themselves, the
+    bands of the albums and songs, and the bands the musicians are members of.
 
-def main():
+    Args:
+        cursor: The MySQL cursor object.
+        wikidata_ids (list): The wikidata_ids of the entities.
+
+    Returns:
+        set: The IDs of the bands.
     """
-    Connects to the MySQL database, prepares and inserts data, and creates junction tables.
+    band_ids = set()
+    for start in range(0, len(wikidata_ids), LOOKUP_CHUNK_SIZE):
+        chunk = wikidata_ids[start:start + LOOKUP_CHUNK_SIZE]
+        placeholders = ', '.join([get_backend().placeholder] * len(chunk))
+        cursor.execute(f"SELECT id FROM band WHERE wikidata_id IN ({placeholders}) "
+                       f"UNION SELECT band_id FROM album WHERE wikidata_id IN ({placeholders}) "
+                       f"UNION SELECT band_id FROM song WHERE wikidata_id IN ({placeholders}) "
+                       f"UNION SELECT band_membership.band_id FROM band_membership "
+                       f"INNER JOIN musician ON band_membership.musician_id = musician.id "
+                       f"WHERE musician.wikidata_id IN ({placeholders})", chunk * 4)
+        band_ids.update(row[0] for row in cursor.fetchall() if row[0] is not None)
+    return band_ids
+
+
+def refresh_aggregates(cursor, band_ids: set = None) -> None:
+    """
+    Rebuilds the summary tables read by the analysis notebooks.
+
+    `band_stats` holds the number of albums, songs, members and genres of every band, and is
+    only rebuilt for the given bands if there are any. `country_decade_stats`, the number of
+    bands per country and decade, and `genre_cooccurrence`, the number of bands sharing every
+    pair of genres, are fully rebuilt with one set-based query each, even on incremental loads.
+    Like the notebooks, `country_decade_stats` only counts bands active for at least a year.
+
+    Args:
+        cursor: The MySQL cursor object.
+        band_ids (set): The bands whose statistics changed. Defaults to all the bands.
+    """
+    start = time.perf_counter()
+    band_stats = ("INSERT INTO band_stats (band_id, album_count, song_count, member_count, genre_count) "
+                  "SELECT band.id, "
+                  "(SELECT COUNT(*) FROM album WHERE album.band_id = band.id), "
+                  "(SELECT COUNT(*) FROM song WHERE song.band_id = band.id), "
+                  "(SELECT COUNT(*) FROM band_membership WHERE band_membership.band_id = band.id), "
+                  "(SELECT COUNT(*) FROM band_genre WHERE band_genre.band_id = band.id) "
+                  "FROM band")
+    if band_ids is None:
+        cursor.execute("DELETE FROM band_stats")
+        cursor.execute(band_stats)
+    else:
+        band_ids = list(band_ids)
+        # The statistics of deleted bands are dropped along with those of the changed ones.
+        cursor.execute("DELETE FROM band_stats WHERE band_id NOT IN (SELECT id FROM band)")
+        for start_idx in range(0, len(band_ids), LOOKUP_CHUNK_SIZE):
+            chunk = band_ids[start_idx:start_idx + LOOKUP_CHUNK_SIZE]
+            placeholders = ', '.join([get_backend().placeholder] * len(chunk))
+            cursor.execute(f"DELETE FROM band_stats WHERE band_id IN ({placeholders})", chunk)
+            cursor.execute(f"{band_stats} WHERE band.id IN ({placeholders})", chunk)
+
+    cursor.execute("DELETE FROM country_decade_stats")
+    cursor.execute("INSERT INTO country_decade_stats (country, decade, band_count) "
+                   "SELECT country, YEAR(start_date) - MOD(YEAR(start_date), 10), COUNT(*) FROM band "
+                   "WHERE country IS NOT NULL AND start_date IS NOT NULL AND name <> '' "
+                   f"AND COALESCE(YEAR(end_date), {ACTIVE_UNTIL_YEAR}) > YEAR(start_date) "
+                   "GROUP BY country, YEAR(start_date) - MOD(YEAR(start_date), 10)")
+    cursor.execute("DELETE FROM genre_cooccurrence")
+    cursor.execute("INSERT INTO genre_cooccurrence (genre_id, other_genre_id, band_count) "
+                   "SELECT g1.genre_id, g2.genre_id, COUNT(*) FROM band_genre g1 "
+                   "INNER JOIN band_genre g2 ON g1.band_id = g2.band_id AND g1.genre_id < g2.genre_id "
+                   "GROUP BY g1.genre_id, g2.genre_id")
+    print(f"Refreshed the summary tables in {time.perf_counter() - start:.2f}s")
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """
+    Parses the command line options of the database loading script.
+
+    Args:
+        argv (list): The arguments to parse. Defaults to `sys.argv[1:]`.
 
-    This function orchestrates the process of connecting to the MySQL database,
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+    parser = argparse.ArgumentParser(description="Load the processed Wikidata items into the database.")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"only apply the changes listed in {CHANGES_FILE} by the last crawl")
+    parser.add_argument("--engine", choices=tuple(TRANSFORM_ENGINES), default="python",
+                        help="transform engine preparing the musician, band, album and song rows")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes formatting items read from detailed_items.json")
+    parser.add_argument("--backend", choices=tuple(BACKENDS),
+                        help="database to load, defaults to the DB_BACKEND setting of config/.env or mysql")
+    parser.add_argument("--bulk", action="store_true",
+                        help="load the rows with LOAD DATA LOCAL INFILE instead of INSERT statements")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None, details_index: DetailsIndex = None):
+    """
+    Connects to the database, prepares and inserts data, and creates junction tables.
+
+    This function orchestrates the process of connecting to the MySQL or SQLite database,
     preparing data from JSON files, replacing wikidata_ids with correct foreign keys,
     inserting the prepared data into respective tables, and creating and inserting data
     into junction tables.
+
+    The label index built by `extract_details.main` can be passed as `details_index` to avoid
+    reading it back from `data/processed`.
+
+    Rows that already exist are updated, so the load can be repeated. With `--incremental`,
+    only the items listed as upserted by the last crawl are written, and the items listed as
+    deleted are removed. The summary tables are refreshed at the end, see `refresh_aggregates`.
+
+    Returns:
+        int: 1 if the load failed or left foreign keys referencing missing rows, in which case
+            the summary tables and the dataset version are left as they were, None otherwise.
     """
+    args = parse_args(argv)
 
-    conn = connect_to_database()
+    backend = get_backend(args.backend)
+    pool = get_pool(allow_local_infile=args.bulk)
+    conn = pool.get_connection()
     cursor = conn.cursor()
     try:
         # Test a simple query to check if the cursor is connected
         cursor.execute("SELECT 1")
         cursor.fetchall()
         print("Cursor is connected to the DB.")
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         print(f"Cursor is not connected to a database: {err}")
-        return
+        return 1
+
+    if backend.schema_file:
+        for statement in read_sql_statements(backend.schema_file):
+            cursor.execute(statement)
+    else:
+        migrate(cursor)
     
     # Read the data from the JSON files
-    raw_genre_data = read_from_json('data/processed/genre_details.json')
-    items = read_from_json("data/processed/detailed_items.json")
-    items = format_items(items)
+    if details_index is None:
+        details_index = DetailsIndex.load("data/processed/", data_types=('genre', 'performer'))
+    raw_genre_data = details_index['genre']
+    if os.path.isdir("data/processed/detailed_items"):
+        items = load_formatted_items("data/processed/detailed_items")
+    else:
+        # Processed data written before the columnar store was introduced.
+        items = format_items_parallel(read_from_json("data/processed/detailed_items.json"), args.workers)
     labels = read_from_json("data/raw/metal_items.json")
-    performers = read_from_json("data/processed/performer_details.json")
+    performers = details_index['performer']
     data_codes = read_from_json("config/data_codes.json")
+    performer_ids = list(performers.keys())
+    genre_ids = list(raw_genre_data.keys())
 
-    # Prepare and inser data into the database
+    # The IDs of the inserted rows, shared by all the stages to resolve foreign keys
+    id_map = IdMap()
+
+    if args.incremental:
+        changes = read_from_json(CHANGES_FILE)
+        upserted = set(changes['upserted'])
+        items = {item_code: item_data for item_code, item_data in items.items() if item_code in upserted}
+        performer_ids = [item_code for item_code in performer_ids if item_code in upserted]
+        genre_ids = [item_code for item_code in genre_ids if item_code in upserted]
+        # Bands summarizing the changed entities before the load, e.g. the band of a deleted album
+        changed_ids = changes['upserted'] + changes['deleted']
+        changed_bands = affected_band_ids(cursor, changed_ids)
+        delete_entities(cursor, changes['deleted'], id_map)
+
+    processors = TRANSFORM_ENGINES[args.engine]
+
+    # Partition the items by entity type once, so that every table only reads its own items
+    entity_items = index_item_types(items, data_codes)
+
+    # Prepare the rows of the entity tables
     genre_data = process_genre(raw_genre_data, data_codes['genres'])   
-    batch_insert(cursor, 'genre', ('genre_name', 'wikidata_id'), genre_data)
-    musician_data = process_musician(items, labels, data_codes['musician_codes'])
-    batch_insert(cursor, 'musician', ('wikidata_id', 'name', 'instrument', 'additional_instrument', 'additional_instrument2', 'additional_instrument3', 'additional_instrument4'), musician_data)
-    band_data = process_band(items, labels, data_codes['band_codes'])
-    batch_insert(cursor, 'band', ('name', 'country', 'wikidata_id', 'start_date', 'end_date'), band_data)
-    album_data = process_album(items, labels, data_codes['album_codes'])
-    album_data = replace_foreign_keys(cursor, 'band', 1, album_data)
-    batch_insert(cursor, 'album', ('name', 'band_id', 'release_date', 'duration', 'type', 'wikidata_id'), album_data)
-    song_data = process_song(items, labels, data_codes['song_codes'])
-    song_data = replace_foreign_keys(cursor, 'band', 1, song_data)
-    song_data = replace_foreign_keys(cursor, 'album', 2, song_data)
-    batch_insert(cursor, 'song', ('name', 'band_id', 'album_id', 'duration', 'wikidata_id'), song_data)
+    musician_data = processors['musician'](items, labels, data_codes['musician_codes'], entity_items.get('musician', []))
+    musician_instrument = processors['musician_instrument'](items, data_codes['musician_codes'], entity_items.get('musician', []))
+    band_data = processors['band'](items, labels, data_codes['band_codes'], entity_items.get('band', []))
+    album_data = processors['album'](items, labels, data_codes['album_codes'], entity_items.get('album', []))
+    song_data = processors['song'](items, labels, data_codes['song_codes'], entity_items.get('song', []))
 
     # Prepare the junction tables
     band_wikidata_ids = [band[2] for band in band_data]
     album_wikidata_ids = [album[5] for album in album_data]
 
-    band_membership = process_junction_data(items, band_wikidata_ids, list(performers.keys()), label='member')
-    band_genre = process_junction_data(items, band_wikidata_ids, list(raw_genre_data.keys()), label='genre')
-    album_genre = process_junction_data(items, album_wikidata_ids, list(raw_genre_data.keys()), label='genre')
-    
-    band_membership = replace_junction_table_fk(cursor, ('band', 'musician'), band_membership)
-    band_genre = replace_junction_table_fk(cursor, ('band', 'genre'), band_genre)
-    album_genre = replace_junction_table_fk(cursor, ('album', 'genre'), album_genre)
-    
-    # Insert the junction tables
-    batch_insert(cursor, 'band_membership', ('band_id', 'musician_id'), band_membership)
-    batch_insert(cursor, 'band_genre', ('band_id', 'genre_id'), band_genre)
-    batch_insert(cursor, 'album_genre', ('album_id', 'genre_id'), album_genre)
+    band_membership = process_junction_data(items, band_wikidata_ids, performer_ids, label='member')
+    band_genre = process_junction_data(items, band_wikidata_ids, genre_ids, label='genre')
+    album_genre = process_junction_data(items, album_wikidata_ids, genre_ids, label='genre')
+
+    if args.incremental:
+        # The memberships and genres of upserted bands and albums are replaced as a whole.
+        band_map = id_map.resolve(cursor, 'band', band_wikidata_ids)
+        album_map = id_map.resolve(cursor, 'album', album_wikidata_ids)
+        band_ids = list({band_map[wikidata_id] for wikidata_id in band_wikidata_ids if wikidata_id in band_map})
+        album_ids = list({album_map[wikidata_id] for wikidata_id in album_wikidata_ids if wikidata_id in album_map})
+        delete_junction_rows(cursor, 'band_membership', 'band_id', band_ids)
+        delete_junction_rows(cursor, 'band_genre', 'band_id', band_ids)
+        delete_junction_rows(cursor, 'album_genre', 'album_id', album_ids)
+        # The same goes for the instruments of upserted musicians.
+        musician_wikidata_ids = [musician[0] for musician in musician_data]
+        musician_map = id_map.resolve(cursor, 'musician', musician_wikidata_ids)
+        musician_ids = list({musician_map[wikidata_id] for wikidata_id in musician_wikidata_ids if wikidata_id in musician_map})
+        delete_junction_rows(cursor, 'musician_instrument', 'musician_id', musician_ids)
+    conn.commit()
 
+    # Insert the data into the database. Tables only wait for the tables they reference, and
+    # foreign keys are checked once everything is loaded.
+    stages = [
+        {'genre': partial(write_entities, table='genre', columns=('genre_name', 'wikidata_id'),
+                          data=genre_data, id_map=id_map, bulk=args.bulk),
+         'musician': partial(write_entities, table='musician', columns=('wikidata_id', 'name'),
+                             data=musician_data, id_map=id_map, bulk=args.bulk),
+         'band': partial(write_entities, table='band', columns=('name', 'country', 'wikidata_id', 'start_date', 'end_date'),
+                         data=band_data, id_map=id_map, bulk=args.bulk)},
+        {'album': partial(write_entities, table='album', columns=('name', 'band_id', 'release_date', 'duration', 'type', 'wikidata_id'),
+                          data=album_data, id_map=id_map, bulk=args.bulk, foreign_keys=(('band', 1),))},
+        {'song': partial(write_entities, table='song', columns=('name', 'band_id', 'album_id', 'duration', 'wikidata_id'),
+                         data=song_data, id_map=id_map, bulk=args.bulk, foreign_keys=(('band', 1), ('album', 2)))},
+        {'band_membership': partial(write_junction_rows, table='band_membership', columns=('band_id', 'musician_id'),
+                                    referenced_tables=('band', 'musician'), data=band_membership, id_map=id_map, bulk=args.bulk),
+         'band_genre': partial(write_junction_rows, table='band_genre', columns=('band_id', 'genre_id'),
+                               referenced_tables=('band', 'genre'), data=band_genre, id_map=id_map, bulk=args.bulk),
+         'album_genre': partial(write_junction_rows, table='album_genre', columns=('album_id', 'genre_id'),
+                                referenced_tables=('album', 'genre'), data=album_genre, id_map=id_map, bulk=args.bulk),
+         'musician_instrument': partial(write_junction_rows, table='musician_instrument', columns=('musician_id', 'instrument'),
+                                        referenced_tables=('musician', None), data=musician_instrument, id_map=id_map, bulk=args.bulk)},
+    ]
+    timings, errors = load_stages(pool, stages)
+    for table, elapsed in timings.items():
+        print(f"Loaded {table} in {elapsed:.2f}s")
+
+    orphans = find_orphans(cursor)
+    for reference, count in orphans.items():
+        print(f"Integrity error: {count} values of {reference} reference missing rows")
+    if errors or orphans:
+        # Summarizing, or publishing a new dataset version for, inconsistent data would let the
+        # notebooks cache it.
+        print("The load is incomplete, fix the errors above and load again. "
+              "The summary tables and the dataset version were not updated.")
+        cursor.close()
+        conn.close()
+        return 1
+    print("All foreign keys reference existing rows.")
+
+    # Summarize the loaded data for the notebooks
+    if args.incremental:
+        refresh_aggregates(cursor, changed_bands | affected_band_ids(cursor, changed_ids))
+    else:
+        refresh_aggregates(cursor)
     conn.commit()
+    write_dataset_version()
+
+    cursor.close()
+    conn.close()
+
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
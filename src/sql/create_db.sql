@@ -2,7 +2,14 @@ CREATE DATABASE IF NOT EXISTS metal_db;
 
 USE metal_db;
 
-CREATE TABLE musician (
+-- The tables below are the baseline schema. Later changes, such as the indexes, are applied by
+-- the numbered scripts in src/sql/migrations, which populate_db.py runs in order and records here.
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INT PRIMARY KEY,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS musician (
     id INT AUTO_INCREMENT PRIMARY KEY,
     wikidata_id VARCHAR(12),
     name VARCHAR(50) NOT NULL,
@@ -13,7 +20,7 @@ CREATE TABLE musician (
     additional_instrument4 VARCHAR(50)
 );
 
-CREATE TABLE band (
+CREATE TABLE IF NOT EXISTS band (
     id INT AUTO_INCREMENT PRIMARY KEY,
     name VARCHAR(55) NOT NULL,
     country VARCHAR(50),
@@ -22,7 +29,7 @@ CREATE TABLE band (
     end_date DATE
 );
 
-CREATE TABLE band_membership (
+CREATE TABLE IF NOT EXISTS band_membership (
     band_id INT,
     musician_id INT,
     PRIMARY KEY (band_id, musician_id),
@@ -30,13 +37,13 @@ CREATE TABLE band_membership (
     FOREIGN KEY (musician_id) REFERENCES musician(id)
 );
 
-CREATE TABLE genre (
+CREATE TABLE IF NOT EXISTS genre (
     id INT AUTO_INCREMENT PRIMARY KEY,
     genre_name VARCHAR(50) NOT NULL,
     wikidata_id VARCHAR(12)
 );
 
-CREATE TABLE band_genre (
+CREATE TABLE IF NOT EXISTS band_genre (
     band_id INT,
     genre_id INT,
     PRIMARY KEY (band_id, genre_id),
@@ -44,7 +51,7 @@ CREATE TABLE band_genre (
     FOREIGN KEY (genre_id) REFERENCES genre(id)
 );
 
-CREATE TABLE album (
+CREATE TABLE IF NOT EXISTS album (
     id INT AUTO_INCREMENT PRIMARY KEY,
     name VARCHAR(100) NOT NULL,
     band_id INT,
@@ -55,7 +62,7 @@ CREATE TABLE album (
     FOREIGN KEY (band_id) REFERENCES band(id)
 );
 
-CREATE TABLE album_genre (
+CREATE TABLE IF NOT EXISTS album_genre (
     album_id INT,
     genre_id INT, 
     PRIMARY KEY (album_id, genre_id),
@@ -63,7 +70,7 @@ CREATE TABLE album_genre (
     FOREIGN KEY (genre_id) REFERENCES genre(id)
 );
 
-CREATE TABLE song (
+CREATE TABLE IF NOT EXISTS song (
     id INT AUTO_INCREMENT PRIMARY KEY,
     name VARCHAR(50) NOT NULL,
     band_id INT,
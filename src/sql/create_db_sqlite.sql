@@ -0,0 +1,104 @@
+-- Schema of the SQLite backend, matching create_db.sql with all the migrations applied.
+
+CREATE TABLE IF NOT EXISTS musician (
+    id INTEGER PRIMARY KEY,
+    wikidata_id VARCHAR(12) UNIQUE,
+    name VARCHAR(50) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS musician_instrument (
+    musician_id INT,
+    instrument VARCHAR(50),
+    PRIMARY KEY (musician_id, instrument),
+    FOREIGN KEY (musician_id) REFERENCES musician(id)
+);
+CREATE INDEX IF NOT EXISTS idx_musician_instrument_instrument ON musician_instrument (instrument, musician_id);
+
+CREATE TABLE IF NOT EXISTS band (
+    id INTEGER PRIMARY KEY,
+    name VARCHAR(55) NOT NULL,
+    country VARCHAR(50),
+    wikidata_id VARCHAR(12) UNIQUE,
+    start_date DATE,
+    end_date DATE
+);
+
+CREATE TABLE IF NOT EXISTS band_membership (
+    band_id INT,
+    musician_id INT,
+    PRIMARY KEY (band_id, musician_id),
+    FOREIGN KEY (band_id) REFERENCES band(id),
+    FOREIGN KEY (musician_id) REFERENCES musician(id)
+);
+CREATE INDEX IF NOT EXISTS idx_band_membership_musician ON band_membership (musician_id, band_id);
+
+CREATE TABLE IF NOT EXISTS genre (
+    id INTEGER PRIMARY KEY,
+    genre_name VARCHAR(50) NOT NULL,
+    wikidata_id VARCHAR(12) UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS band_genre (
+    band_id INT,
+    genre_id INT,
+    PRIMARY KEY (band_id, genre_id),
+    FOREIGN KEY (band_id) REFERENCES band(id),
+    FOREIGN KEY (genre_id) REFERENCES genre(id)
+);
+CREATE INDEX IF NOT EXISTS idx_band_genre_genre ON band_genre (genre_id, band_id);
+
+CREATE TABLE IF NOT EXISTS album (
+    id INTEGER PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    band_id INT,
+    release_date DATE,
+    duration INT,
+    type VARCHAR(50),
+    wikidata_id VARCHAR(12) UNIQUE,
+    FOREIGN KEY (band_id) REFERENCES band(id)
+);
+CREATE INDEX IF NOT EXISTS idx_album_band ON album (band_id);
+
+CREATE TABLE IF NOT EXISTS album_genre (
+    album_id INT,
+    genre_id INT,
+    PRIMARY KEY (album_id, genre_id),
+    FOREIGN KEY (album_id) REFERENCES album(id),
+    FOREIGN KEY (genre_id) REFERENCES genre(id)
+);
+CREATE INDEX IF NOT EXISTS idx_album_genre_genre ON album_genre (genre_id, album_id);
+
+CREATE TABLE IF NOT EXISTS song (
+    id INTEGER PRIMARY KEY,
+    name VARCHAR(50) NOT NULL,
+    band_id INT,
+    album_id INT,
+    duration INT,
+    wikidata_id VARCHAR(12) UNIQUE,
+    FOREIGN KEY (band_id) REFERENCES band(id),
+    FOREIGN KEY (album_id) REFERENCES album(id)
+);
+CREATE INDEX IF NOT EXISTS idx_song_band ON song (band_id);
+CREATE INDEX IF NOT EXISTS idx_song_album ON song (album_id);
+
+CREATE TABLE IF NOT EXISTS band_stats (
+    band_id INT PRIMARY KEY,
+    album_count INT NOT NULL,
+    song_count INT NOT NULL,
+    member_count INT NOT NULL,
+    genre_count INT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS country_decade_stats (
+    country VARCHAR(50),
+    decade INT,
+    band_count INT NOT NULL,
+    PRIMARY KEY (country, decade)
+);
+
+CREATE TABLE IF NOT EXISTS genre_cooccurrence (
+    genre_id INT,
+    other_genre_id INT,
+    band_count INT NOT NULL,
+    PRIMARY KEY (genre_id, other_genre_id)
+);
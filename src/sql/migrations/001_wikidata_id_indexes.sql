@@ -0,0 +1,74 @@
+-- Adds unique indexes on the wikidata_id of the entity tables and reverse indexes on the
+-- junction tables. Rows loaded more than once by earlier runs are first collapsed onto the
+-- row with the lowest id, and the references to the other copies are moved to it.
+
+CREATE TEMPORARY TABLE band_duplicate AS
+    SELECT t.id, k.keep_id
+    FROM band t
+    JOIN (SELECT wikidata_id, MIN(id) AS keep_id FROM band GROUP BY wikidata_id HAVING COUNT(*) > 1) k
+        ON t.wikidata_id = k.wikidata_id AND t.id <> k.keep_id;
+UPDATE IGNORE band_membership r JOIN band_duplicate d ON r.band_id = d.id SET r.band_id = d.keep_id;
+DELETE r FROM band_membership r JOIN band_duplicate d ON r.band_id = d.id;
+UPDATE IGNORE band_genre r JOIN band_duplicate d ON r.band_id = d.id SET r.band_id = d.keep_id;
+DELETE r FROM band_genre r JOIN band_duplicate d ON r.band_id = d.id;
+UPDATE album r JOIN band_duplicate d ON r.band_id = d.id SET r.band_id = d.keep_id;
+UPDATE song r JOIN band_duplicate d ON r.band_id = d.id SET r.band_id = d.keep_id;
+DELETE t FROM band t JOIN band_duplicate d ON t.id = d.id;
+DROP TEMPORARY TABLE band_duplicate;
+
+CREATE TEMPORARY TABLE musician_duplicate AS
+    SELECT t.id, k.keep_id
+    FROM musician t
+    JOIN (SELECT wikidata_id, MIN(id) AS keep_id FROM musician GROUP BY wikidata_id HAVING COUNT(*) > 1) k
+        ON t.wikidata_id = k.wikidata_id AND t.id <> k.keep_id;
+UPDATE IGNORE band_membership r JOIN musician_duplicate d ON r.musician_id = d.id SET r.musician_id = d.keep_id;
+DELETE r FROM band_membership r JOIN musician_duplicate d ON r.musician_id = d.id;
+DELETE t FROM musician t JOIN musician_duplicate d ON t.id = d.id;
+DROP TEMPORARY TABLE musician_duplicate;
+
+CREATE TEMPORARY TABLE genre_duplicate AS
+    SELECT t.id, k.keep_id
+    FROM genre t
+    JOIN (SELECT wikidata_id, MIN(id) AS keep_id FROM genre GROUP BY wikidata_id HAVING COUNT(*) > 1) k
+        ON t.wikidata_id = k.wikidata_id AND t.id <> k.keep_id;
+UPDATE IGNORE band_genre r JOIN genre_duplicate d ON r.genre_id = d.id SET r.genre_id = d.keep_id;
+DELETE r FROM band_genre r JOIN genre_duplicate d ON r.genre_id = d.id;
+UPDATE IGNORE album_genre r JOIN genre_duplicate d ON r.genre_id = d.id SET r.genre_id = d.keep_id;
+DELETE r FROM album_genre r JOIN genre_duplicate d ON r.genre_id = d.id;
+DELETE t FROM genre t JOIN genre_duplicate d ON t.id = d.id;
+DROP TEMPORARY TABLE genre_duplicate;
+
+CREATE TEMPORARY TABLE album_duplicate AS
+    SELECT t.id, k.keep_id
+    FROM album t
+    JOIN (SELECT wikidata_id, MIN(id) AS keep_id FROM album GROUP BY wikidata_id HAVING COUNT(*) > 1) k
+        ON t.wikidata_id = k.wikidata_id AND t.id <> k.keep_id;
+UPDATE IGNORE album_genre r JOIN album_duplicate d ON r.album_id = d.id SET r.album_id = d.keep_id;
+DELETE r FROM album_genre r JOIN album_duplicate d ON r.album_id = d.id;
+UPDATE song r JOIN album_duplicate d ON r.album_id = d.id SET r.album_id = d.keep_id;
+DELETE t FROM album t JOIN album_duplicate d ON t.id = d.id;
+DROP TEMPORARY TABLE album_duplicate;
+
+CREATE TEMPORARY TABLE song_duplicate AS
+    SELECT t.id, k.keep_id
+    FROM song t
+    JOIN (SELECT wikidata_id, MIN(id) AS keep_id FROM song GROUP BY wikidata_id HAVING COUNT(*) > 1) k
+        ON t.wikidata_id = k.wikidata_id AND t.id <> k.keep_id;
+DELETE t FROM song t JOIN song_duplicate d ON t.id = d.id;
+DROP TEMPORARY TABLE song_duplicate;
+
+ALTER TABLE genre ADD UNIQUE INDEX uq_genre_wikidata_id (wikidata_id);
+
+ALTER TABLE musician ADD UNIQUE INDEX uq_musician_wikidata_id (wikidata_id);
+
+ALTER TABLE band ADD UNIQUE INDEX uq_band_wikidata_id (wikidata_id);
+
+ALTER TABLE album ADD UNIQUE INDEX uq_album_wikidata_id (wikidata_id);
+
+ALTER TABLE song ADD UNIQUE INDEX uq_song_wikidata_id (wikidata_id);
+
+ALTER TABLE band_membership ADD INDEX idx_band_membership_musician (musician_id, band_id);
+
+ALTER TABLE band_genre ADD INDEX idx_band_genre_genre (genre_id, band_id);
+
+ALTER TABLE album_genre ADD INDEX idx_album_genre_genre (genre_id, album_id);
@@ -0,0 +1,24 @@
+-- Moves the instruments of musicians from the five instrument columns of the musician table to
+-- the musician_instrument table, which holds any number of instruments per musician.
+
+CREATE TABLE IF NOT EXISTS musician_instrument (
+    musician_id INT,
+    instrument VARCHAR(50),
+    PRIMARY KEY (musician_id, instrument),
+    INDEX idx_musician_instrument_instrument (instrument, musician_id),
+    FOREIGN KEY (musician_id) REFERENCES musician(id)
+);
+
+INSERT IGNORE INTO musician_instrument (musician_id, instrument)
+    SELECT id, instrument FROM musician WHERE instrument IS NOT NULL
+    UNION ALL SELECT id, additional_instrument FROM musician WHERE additional_instrument IS NOT NULL
+    UNION ALL SELECT id, additional_instrument2 FROM musician WHERE additional_instrument2 IS NOT NULL
+    UNION ALL SELECT id, additional_instrument3 FROM musician WHERE additional_instrument3 IS NOT NULL
+    UNION ALL SELECT id, additional_instrument4 FROM musician WHERE additional_instrument4 IS NOT NULL;
+
+ALTER TABLE musician
+    DROP COLUMN instrument,
+    DROP COLUMN additional_instrument,
+    DROP COLUMN additional_instrument2,
+    DROP COLUMN additional_instrument3,
+    DROP COLUMN additional_instrument4;
@@ -0,0 +1,24 @@
+-- Adds the summary tables rebuilt by populate_db after every load. They hold derived data only,
+-- so they have no foreign keys and can be refreshed independently of the tables they summarize.
+
+CREATE TABLE IF NOT EXISTS band_stats (
+    band_id INT PRIMARY KEY,
+    album_count INT NOT NULL,
+    song_count INT NOT NULL,
+    member_count INT NOT NULL,
+    genre_count INT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS country_decade_stats (
+    country VARCHAR(50),
+    decade INT,
+    band_count INT NOT NULL,
+    PRIMARY KEY (country, decade)
+);
+
+CREATE TABLE IF NOT EXISTS genre_cooccurrence (
+    genre_id INT,
+    other_genre_id INT,
+    band_count INT NOT NULL,
+    PRIMARY KEY (genre_id, other_genre_id)
+);
@@ -0,0 +1,244 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+
+def make_key(*parts: str) -> str:
+    """
+    Builds a content-addressed cache key from the given parts.
+
+    Args:
+        *parts (str): The values identifying the cached content, e.g. an endpoint and a query.
+
+    Returns:
+        str: The hexadecimal SHA-256 digest of the parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Size-bounded, least-recently-used cache of values stored as files in a directory.
+
+    Every entry lives in its own file named after its key. The modification time of the file
+    records when the entry was written, and is used for expiry, while the access time records
+    when it was last read, and is used for eviction. Subclasses choose the file format by
+    overriding `suffix`, `dump` and `load`.
+
+    Attributes:
+        hits (int): The number of lookups that found a fresh entry.
+        misses (int): The number of lookups that found no entry or an expired one.
+        evictions (int): The number of entries removed to stay within `max_bytes`.
+    """
+
+    suffix = ".json.gz"
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Rebuild the LRU order from the access times left by previous runs.
+        entries = []
+        for name in os.listdir(cache_dir):
+            if name.endswith(self.suffix):
+                stat = os.stat(os.path.join(cache_dir, name))
+                entries.append((stat.st_atime, name[:-len(self.suffix)], stat.st_size))
+        self.index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.size = sum(self.index.values())
+
+    def dump(self, value, file_path: str) -> None:
+        """Writes a value to a file. Stores it as gzip-compressed JSON by default."""
+        with gzip.open(file_path, "wt", encoding="utf-8") as cache_file:
+            json.dump(value, cache_file, ensure_ascii=False)
+
+    def load(self, file_path: str):
+        """Reads a value written by `dump`."""
+        with gzip.open(file_path, "rt", encoding="utf-8") as cache_file:
+            return json.load(cache_file)
+
+    def path(self, key: str) -> str:
+        """Returns the path of the file holding the entry for a key."""
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def get(self, key: str, ttl: float = None):
+        """
+        Looks up an entry.
+
+        Args:
+            key (str): The key of the entry, see `make_key`.
+            ttl (float): The maximum age of the entry in seconds. Defaults to no expiry.
+
+        Returns:
+            The cached value, or None if there is no fresh entry for the key.
+        """
+        file_path = self.path(key)
+        with self.lock:
+            if key not in self.index:
+                self.misses += 1
+                return None
+            try:
+                expired = ttl is not None and time.time() - os.path.getmtime(file_path) > ttl
+            except OSError:
+                # The file was removed by another process.
+                expired = True
+            if expired:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self.index.move_to_end(key)
+            self.hits += 1
+        try:
+            value = self.load(file_path)
+        except (OSError, EOFError, ValueError):
+            # The entry was evicted by another thread or left incomplete by a crash.
+            with self.lock:
+                if key in self.index:
+                    self._remove(key)
+                self.hits -= 1
+                self.misses += 1
+            return None
+        try:
+            os.utime(file_path, (time.time(), os.path.getmtime(file_path)))
+        except OSError:
+            pass
+        return value
+
+    def put(self, key: str, value) -> None:
+        """
+        Stores an entry, evicting the least recently used entries if the cache grows
+        beyond `max_bytes`.
+
+        Args:
+            key (str): The key of the entry, see `make_key`.
+            value: The value to store.
+        """
+        file_path = self.path(key)
+        temp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        self.dump(value, temp_path)
+        os.replace(temp_path, file_path)
+        with self.lock:
+            self.size -= self.index.pop(key, 0)
+            self.index[key] = os.path.getsize(file_path)
+            self.size += self.index[key]
+            while self.size > self.max_bytes and len(self.index) > 1:
+                self._remove(next(iter(self.index)))
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        """Removes the entry for a key, if there is one."""
+        with self.lock:
+            if key in self.index:
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        self.size -= self.index.pop(key)
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> str:
+        """Returns a one-line summary of the cache usage."""
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0
+        return (f"{self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+                f"{self.evictions} evictions, {len(self.index)} entries, {self.size / 2**20:.1f} MB")
+
+
+class SentimentStore:
+    """
+    Persistent store of zero-shot classification results, in a SQLite database.
+
+    A result is keyed by the text with its whitespace normalized, the sorted candidate labels
+    and the model, so classifying the same titles again against the same labels only costs a
+    lookup, whatever the order of the labels.
+
+    Usage:
+        store = SentimentStore("data/cache/sentiment.sqlite")
+        found = store.get_many(texts, labels, model)
+        store.put_many({text: scores for text, scores in new_results}, labels, model)
+    """
+
+    # Number of texts per lookup query, below the SQLite limit on query parameters
+    LOOKUP_CHUNK_SIZE = 500
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS sentiment (
+                    text TEXT NOT NULL,
+                    labels TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    scores TEXT NOT NULL,
+                    PRIMARY KEY (text, labels, model)
+                )""")
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Collapses the runs of whitespace of a text, which do not change its classification."""
+        return " ".join(text.split())
+
+    @staticmethod
+    def labels_key(labels: list) -> str:
+        return json.dumps(sorted(labels), ensure_ascii=False)
+
+    def get_many(self, texts: list, labels: list, model: str) -> dict:
+        """
+        Looks up the results of several texts at once.
+
+        Args:
+            texts (list): The normalized texts, see `normalize`.
+            labels (list): The candidate labels.
+            model (str): The model of the classifier.
+
+        Returns:
+            dict: The scores of every label, by label, for each text with a stored result.
+        """
+        texts = list(dict.fromkeys(texts))
+        found = {}
+        with self.lock:
+            for start in range(0, len(texts), self.LOOKUP_CHUNK_SIZE):
+                chunk = texts[start:start + self.LOOKUP_CHUNK_SIZE]
+                rows = self.conn.execute(
+                    f"SELECT text, scores FROM sentiment WHERE labels = ? AND model = ? "
+                    f"AND text IN ({', '.join('?' * len(chunk))})",
+                    (self.labels_key(labels), model, *chunk))
+                found.update((text, json.loads(scores)) for text, scores in rows)
+        return found
+
+    def put_many(self, results: dict, labels: list, model: str) -> None:
+        """
+        Stores the results of several texts in one transaction.
+
+        Args:
+            results (dict): The scores of every label, by label, for each normalized text.
+            labels (list): The candidate labels.
+            model (str): The model of the classifier.
+        """
+        key = self.labels_key(labels)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO sentiment (text, labels, model, scores) VALUES (?, ?, ?, ?)",
+                ((text, key, model, json.dumps(scores)) for text, scores in results.items()))
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM sentiment").fetchone()[0]
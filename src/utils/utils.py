@@ -1,4 +1,11 @@
 import json
+import re
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+_WHITESPACE = re.compile(r"\s*")
 
 
 def read_from_json(data_file: str) -> dict:
@@ -16,6 +23,78 @@ def read_from_json(data_file: str) -> dict:
     return data
 
 
+def iter_json_object(data_file: str, chunk_size: int = 2 ** 20):
+    """
+    Iterates over the members of the JSON object stored in a file without loading the whole
+    file, reading it in chunks and decoding one member at a time.
+
+    Args:
+        data_file (str): The path to the JSON file to read. It must contain a single object.
+        chunk_size (int): The number of characters read from the file at a time.
+
+    Yields:
+        tuple: The `(key, value)` pairs of the object, in file order.
+
+    Raises:
+        ValueError: If the file does not contain a valid JSON object.
+    """
+    decoder = json.JSONDecoder()
+    with open(data_file, encoding="utf-8") as json_file:
+        buffer, position, eof = "", 0, False
+        state, key = "start", None
+
+        def read_chunk():
+            nonlocal buffer, position, eof
+            if eof:
+                raise ValueError(f"Unexpected end of JSON file {data_file}")
+            chunk = json_file.read(chunk_size)
+            buffer, position, eof = buffer[position:] + chunk, 0, not chunk
+
+        while True:
+            position = _WHITESPACE.match(buffer, position).end()
+            if position == len(buffer):
+                read_chunk()
+                continue
+            char = buffer[position]
+            if state == "start":
+                if char != "{":
+                    raise ValueError(f"Expected a JSON object in {data_file}")
+                position, state = position + 1, "first_key"
+            elif state in ("first_key", "key"):
+                if char == "}" and state == "first_key":
+                    return
+                try:
+                    key, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    read_chunk()
+                    continue
+                if not isinstance(key, str):
+                    raise ValueError(f"Expected an object key in {data_file}")
+                position, state = end, "colon"
+            elif state == "colon":
+                if char != ":":
+                    raise ValueError(f"Expected ':' in {data_file}")
+                position, state = position + 1, "value"
+            elif state == "value":
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    read_chunk()
+                    continue
+                # A number may continue in the next chunk, so only accept values followed by something.
+                if end == len(buffer) and not eof:
+                    read_chunk()
+                    continue
+                yield key, value
+                position, state = end, "separator"
+            elif char == ",":
+                position, state = position + 1, "key"
+            elif char == "}":
+                return
+            else:
+                raise ValueError(f"Expected ',' or '}}' in {data_file}")
+
+
 def write_to_json(data: dict, file_path: str) -> None:
     """
     Writes data to a JSON file.
@@ -28,4 +107,105 @@ def write_to_json(data: dict, file_path: str) -> None:
         None
     """
     with open(file_path, "w") as outfile: 
-        json.dump(data, outfile, indent=2, ensure_ascii=False)
\ No newline at end of file
+        json.dump(data, outfile, indent=2, ensure_ascii=False)
+
+
+def iter_jsonl(file_path: str):
+    """
+    Iterates over the records of a JSON Lines file.
+
+    An incomplete last line, as left behind by a process killed while appending to the
+    file, is skipped.
+
+    Args:
+        file_path (str): The path to the JSON Lines file to read.
+
+    Yields:
+        The data decoded from each line of the file.
+    """
+    with open(file_path, encoding="utf-8") as jsonl_file:
+        for line in jsonl_file:
+            if not line.endswith("\n"):
+                break
+            yield json.loads(line)
+
+
+class JsonObjectWriter:
+    """
+    Writes a JSON object to a file one member at a time, so that the whole object never
+    has to be held in memory.
+
+    The output is formatted like `write_to_json` formats a dictionary.
+
+    Usage:
+        with JsonObjectWriter("data.json") as writer:
+            writer.write(key, value)
+    """
+
+    def __init__(self, file_path: str, indent: int = 2):
+        self.file_path = file_path
+        self.indent = indent
+        self.count = 0
+        self.outfile = None
+
+    def __enter__(self):
+        self.outfile = open(self.file_path, "w", encoding="utf-8")
+        self.outfile.write("{")
+        return self
+
+    def write(self, key: str, value) -> None:
+        """Appends a member to the JSON object."""
+        padding = " " * self.indent
+        value = json.dumps(value, indent=self.indent, ensure_ascii=False).replace("\n", "\n" + padding)
+        separator = "," if self.count else ""
+        self.outfile.write(f"{separator}\n{padding}{json.dumps(key, ensure_ascii=False)}: {value}")
+        self.count += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.outfile.write("\n}" if self.count else "}")
+        self.outfile.close()
+
+
+def iter_shards(iterable, shard_size: int):
+    """
+    Splits an iterable into consecutive lists of at most `shard_size` elements.
+
+    Args:
+        iterable: The elements to split.
+        shard_size (int): The maximum number of elements per shard.
+
+    Yields:
+        list: The shards, in order.
+    """
+    iterator = iter(iterable)
+    while shard := list(islice(iterator, shard_size)):
+        yield shard
+
+
+def parallel_map(function, iterable, workers: int = 1):
+    """
+    Applies a function to every element of an iterable in a pool of worker processes, yielding
+    the results in input order so that the output does not depend on the number of workers.
+
+    At most two tasks per worker are queued at a time, so the iterable is consumed lazily.
+
+    Args:
+        function: The function to apply. It must be picklable, e.g. defined at module level.
+        iterable: The elements to process, e.g. shards built by `iter_shards`.
+        workers (int): The number of worker processes. With a single worker the function is
+            applied in the calling process.
+
+    Yields:
+        The result of the function for each element, in order.
+    """
+    if workers <= 1:
+        yield from map(function, iterable)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for element in iterable:
+            pending.append(executor.submit(function, element))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()